@@ -0,0 +1,323 @@
+"""Offline benchmark of the summarize and journal pipelines.
+
+Runs the commands of main.py against a fake discord client serving synthetic channel histories and the fake LLM
+backend, and reports for each history size the time spent in every stage, the peak memory and the prompt size.
+
+usage: python benchmark.py [--sizes 1000 10000 ...] [--llm-latency 0.5] [--page-delay 0.005] [--mode single]
+"""
+import argparse
+import asyncio
+import bisect
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# main.py reads its configuration when imported
+os.environ.setdefault('HOURS_TO_SUMMARIZE', '720')
+os.environ.setdefault('HOURS_OF_CONTEXT', '1440')
+os.environ['LLM_BACKEND'] = 'fake'
+os.environ['ARCHIVE_PATH'] = os.path.join(tempfile.mkdtemp(), 'archive.db')
+os.environ['METRICS_JSONL_PATH'] = os.path.join(tempfile.mkdtemp(), 'metrics.jsonl')
+os.environ['METRICS_PROMETHEUS_PATH'] = os.path.join(tempfile.mkdtemp(), 'metrics.prom')
+# every run goes through the whole pipeline instead of reusing the snapshot of the previous one
+os.environ['SNAPSHOT_TTL'] = '0'
+
+import discord
+
+import main
+
+nations = ["Dolivageä", "Nalvarune", "Goast", "Cushy", "Algard", "Osterces", "Zagrivocha", "Vicciopolis", "Astréa",
+           "Azurentos", "Panitropole", "Solimé"]
+words = ["le", "la", "roi", "annonce", "traité", "guerre", "alliance", "fonde", "ville", "armée", "commerce", "paix",
+         "de", "et", "des", "nouvelle", "route", "château", "élection", "conseil", "marché", "port", "accord"]
+
+
+class FakeUser:
+    def __init__(self, id, display_name):
+        self.id = id
+        self.display_name = display_name
+        self.bot = False
+
+
+class FakeMessage:
+    __slots__ = ('id', 'channel', 'created_at', 'author', 'content', 'mentions', 'role_mentions',
+                 'channel_mentions', 'guild')
+
+    def __init__(self, id, channel, created_at, author, content, mentions, channel_mentions):
+        self.id = id
+        self.channel = channel
+        self.created_at = created_at
+        self.author = author
+        self.content = content
+        self.mentions = mentions
+        self.role_mentions = []
+        self.channel_mentions = channel_mentions
+        self.guild = None
+
+
+class FakeChannel:
+    """Channel serving a synthetic history by pages of 100 messages, like discord does."""
+
+    def __init__(self, id, name, page_delay):
+        self.id = id
+        self.name = name
+        self.page_delay = page_delay
+        # sorted by id, from oldest to newest
+        self.messages = []
+        self.ids = []
+        self.pages = 0
+
+    @staticmethod
+    def snowflake(bound, high):
+        if bound is None:
+            return None
+        if isinstance(bound, datetime):
+            return discord.utils.time_snowflake(bound, high=high)
+        return getattr(bound, 'id', bound)
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=None):
+        before = self.snowflake(before, high=False)
+        after = self.snowflake(after, high=True)
+        start = bisect.bisect_right(self.ids, after) if after is not None else 0
+        end = bisect.bisect_left(self.ids, before) if before is not None else len(self.ids)
+        selected = self.messages[start:end]
+        if oldest_first is None:
+            oldest_first = after is not None and before is None
+        if not oldest_first:
+            selected = selected[::-1]
+        if limit is not None:
+            selected = selected[:limit]
+
+        for i in range(0, len(selected), 100):
+            self.pages += 1
+            await asyncio.sleep(self.page_delay)
+            for message in selected[i:i + 100]:
+                yield message
+
+
+class FakeSentMessage:
+    def __init__(self, output, content):
+        self.output = output
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.output.edits += 1
+        self.content = content
+
+
+class FakeOutputChannel:
+    """Controller channel recording what the commands send."""
+
+    id = 0
+
+    def __init__(self):
+        self.sends = 0
+        self.edits = 0
+
+    def typing(self):
+        return FakeTyping()
+
+    async def send(self, content=None, **kwargs):
+        self.sends += 1
+        return FakeSentMessage(self, content)
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeCommand:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.author = FakeUser(0, "controller")
+
+
+class BenchmarkClient(main.MyClient):
+    def __init__(self, channels, users):
+        super().__init__()
+        self.fake_channels = {channel.id: channel for channel in channels}
+        self.fake_users = {user.id: user for user in users}
+
+    def get_channel(self, channel_id):
+        return self.fake_channels.get(channel_id)
+
+    def get_user(self, user_id):
+        return self.fake_users.get(user_id)
+
+
+def build_history(channels, users, n_messages, hours, seed=0):
+    """Spread n_messages over the last hours between the channels, with mentions and wiki links."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    timestamps = sorted(now - timedelta(seconds=rng.uniform(0, hours * 3600)) for _ in range(n_messages))
+    for i, created_at in enumerate(timestamps):
+        channel = channels[i % len(channels)]
+        content_words = [rng.choice(words) for _ in range(rng.randint(1, 60))]
+        mentions = []
+        channel_mentions = []
+        if rng.random() < 0.3:
+            content_words.insert(rng.randrange(len(content_words)), rng.choice(nations))
+        if rng.random() < 0.1:
+            content_words.append(f"[[{rng.choice(nations)}]]")
+        if rng.random() < 0.15:
+            user = rng.choice(users)
+            mentions.append(user)
+            content_words.insert(0, f"<@{user.id}>")
+        if rng.random() < 0.05:
+            mentioned_channel = rng.choice(channels)
+            channel_mentions.append(mentioned_channel)
+            content_words.append(f"<#{mentioned_channel.id}>")
+        # the low bits keep the ids unique when two messages share a millisecond
+        message_id = discord.utils.time_snowflake(created_at) + i % (1 << 22)
+        channel.messages.append(FakeMessage(message_id, channel, created_at, rng.choice(users),
+                                            ' '.join(content_words), mentions, channel_mentions))
+    for channel in channels:
+        channel.messages.sort(key=lambda message: message.id)
+        channel.ids = [message.id for message in channel.messages]
+
+
+class StageTimer:
+    """Sums the wall time spent in the wrapped functions, by stage. Concurrent calls are summed too."""
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap_async(self, stage, function):
+        async def wrapped(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.times[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+        return wrapped
+
+    def wrap(self, stage, function):
+        def wrapped(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.times[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+        return wrapped
+
+
+def instrument(client, timer, prompt_sizes):
+    """Wrap the pipeline functions of main.py to time its stages and record the prompt sizes."""
+    client.fetch_channels = timer.wrap_async('fetch', client.fetch_channels)
+    client.build_messages_str = timer.wrap_async('format', client.build_messages_str)
+    client.send_response = timer.wrap_async('send', client.send_response)
+    client.remove_noise = timer.wrap('filter', client.remove_noise)
+    main.split_messages_by_hours = timer.wrap_async('split', original_split_messages_by_hours)
+    main.pack_context = timer.wrap('prompt', original_pack_context)
+    main.build_summary_prompt = timer.wrap('prompt', original_build_summary_prompt)
+    main.build_journal_prompt = timer.wrap('prompt', original_build_journal_prompt)
+    main.generate_response_async = timer.wrap_async('generate', original_generate_response_async)
+
+    backend_generate = main.llm_backend.generate
+
+    def generate(user_input, system_instruction, *args, **kwargs):
+        prompt_sizes.append((len(user_input) + len(system_instruction or ''),
+                             main.estimate_tokens(user_input) + main.estimate_tokens(system_instruction or '')))
+        return backend_generate(user_input, system_instruction, *args, **kwargs)
+
+    main.llm_backend.generate = generate
+
+
+original_split_messages_by_hours = main.split_messages_by_hours
+original_pack_context = main.pack_context
+original_build_summary_prompt = main.build_summary_prompt
+original_build_journal_prompt = main.build_journal_prompt
+original_generate_response_async = main.generate_response_async
+
+
+async def run_command(client, command, channels, trace_memory):
+    timer = StageTimer()
+    prompt_sizes = []
+    instrument(client, timer, prompt_sizes)
+    output = FakeOutputChannel()
+    pages_before = sum(channel.pages for channel in channels)
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await getattr(client, command)(FakeCommand(output, f"${command}"))
+    total = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'total': total,
+        'stages': dict(timer.times),
+        'pages': sum(channel.pages for channel in channels) - pages_before,
+        'peak_mb': peak / 1024 / 1024,
+        'prompt_chars': max((chars for chars, _ in prompt_sizes), default=0),
+        'prompt_tokens': sum(tokens for _, tokens in prompt_sizes),
+        'llm_calls': len(prompt_sizes),
+        'sends': output.sends,
+        'edits': output.edits,
+    }
+
+
+def print_result(command, size, run, result):
+    stages = ' '.join(f"{stage}={seconds:.3f}s" for stage, seconds in sorted(result['stages'].items()))
+    print(f"{command:<9} {size:>7} msgs {run:<4} total={result['total']:.3f}s {stages} pages={result['pages']} "
+          f"peak={result['peak_mb']:.1f}MB prompt={result['prompt_chars']} chars "
+          f"(~{result['prompt_tokens']} tokens over {result['llm_calls']} calls) "
+          f"sends={result['sends']} edits={result['edits']}")
+
+
+async def benchmark(arguments):
+    main.summary_mode = arguments.mode
+    main.llm_backend = main.FakeBackend(arguments.llm_latency)
+
+    for size in arguments.sizes:
+        users = [FakeUser(1000 + i, f"Joueur {i}") for i in range(200)]
+        channels = [FakeChannel(channel_id, f"salon-{i}", arguments.page_delay)
+                    for i, channel_id in enumerate(main.channel_ids)]
+        build_history(channels, users, size, main.context_hours)
+
+        # every size starts from an empty archive, the second run shows what the archive saves
+        archive_path = os.path.join(tempfile.mkdtemp(), 'archive.db')
+        main.message_archive = main.MessageArchive(archive_path)
+        main.day_summary_cache = main.DaySummaryCache(archive_path)
+
+        for command in arguments.commands:
+            for run in ('cold', 'warm'):
+                client = BenchmarkClient(channels, users)
+                result = await run_command(client, command, channels, not arguments.no_memory)
+                print_result(command, size, run, result)
+            # the next command starts cold again
+            archive_path = os.path.join(tempfile.mkdtemp(), 'archive.db')
+            main.message_archive = main.MessageArchive(archive_path)
+            main.day_summary_cache = main.DaySummaryCache(archive_path)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 500000],
+                        help="number of messages of the synthetic histories")
+    parser.add_argument('--commands', nargs='+', default=['summarize', 'journal'], choices=['summarize', 'journal'])
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="seconds taken by each fake LLM call")
+    parser.add_argument('--page-delay', type=float, default=0.005, help="seconds taken by each history page")
+    parser.add_argument('--mode', default=main.summary_mode, choices=['single', 'map_reduce'])
+    parser.add_argument('--no-memory', action='store_true',
+                        help="don't trace the peak memory (tracemalloc slows the run down)")
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_benchmark()
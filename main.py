@@ -1,7 +1,27 @@
+import asyncio
+import bisect
+import calendar
+import contextlib
 import datetime
+import functools
+import hashlib
+import io
+import itertools
+import json
+import math
 import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching
 from discord import Message
 from dotenv import load_dotenv
 
@@ -11,70 +31,361 @@ gemini_api_key = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=gemini_api_key)
 
 
-def generate_response(user_input, system_instruction, model="gemini-1.5-pro-002", generation_config=None,
-                      safety_settings=None):
-    if not generation_config:
-        generation_config = {
-            "temperature": 0.5,
-            "max_output_tokens": 32000,
-        }
-    if not safety_settings:
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            },
-        ]
-
-    model = genai.GenerativeModel(model_name=model,
-                                  generation_config=generation_config,
-                                  system_instruction=system_instruction,
-                                  safety_settings=safety_settings)
-    convo = model.start_chat(history=[
-    ])
-    convo.send_message(user_input)
-    return convo.last.text
+default_generation_config = {
+    "temperature": 0.5,
+    "max_output_tokens": 32000,
+}
+
+default_safety_settings = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_NONE"
+    },
+]
+
+
+def freeze_settings(settings):
+    """Turn a config dict (or a list of them) into nested tuples so it can be used as a cache key."""
+    if isinstance(settings, dict):
+        return tuple(sorted(settings.items()))
+    return tuple(freeze_settings(setting) for setting in settings)
+
+
+@functools.lru_cache(maxsize=32)
+def get_model(model_name, generation_config, system_instruction, safety_settings):
+    """Return a configured model, reused by every call made with the same settings.
+
+    The configs are given frozen (see freeze_settings). All the models share the transport of genai's default client.
+    """
+    return genai.GenerativeModel(model_name=model_name,
+                                 generation_config=dict(generation_config),
+                                 system_instruction=system_instruction,
+                                 safety_settings=[dict(setting) for setting in safety_settings])
+
+
+# minimum estimated size of a system instruction for it to be cached on the provider side. Gemini 1.5 refuses to
+# cache less than 32768 tokens, so smaller prompts are sent in full every time
+context_cache_min_tokens = int(os.getenv('CONTEXT_CACHE_MIN_TOKENS', '32768'))
+
+# how long the provider keeps a cached system instruction
+context_cache_ttl_minutes = int(os.getenv('CONTEXT_CACHE_TTL_MINUTES', '60'))
+
+
+class TokenUsage:
+    """Tokens used by the calls of a command run, the input ones being split between cached and fresh ones."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.response_tokens = 0
+
+    def add(self, prompt_tokens, cached_tokens, response_tokens):
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.response_tokens += response_tokens
+
+    def report(self):
+        return (f"Input tokens: {self.prompt_tokens} ({self.cached_tokens} cached, "
+                f"{self.prompt_tokens - self.cached_tokens} fresh), output tokens: {self.response_tokens}")
+
+
+class LLMBackend:
+    """Generates responses, keeping the static system instructions cached on the provider side when possible.
+
+    Subclasses implement create_cache and generate_content, the caching logic is shared.
+    """
+
+    def __init__(self):
+        # called from the generation worker threads
+        self.lock = threading.Lock()
+        # (model name, system instruction hash) -> (cache, expiration time), cache is None if it couldn't be created
+        self.caches = {}
+
+    def get_cache(self, model_name, system_instruction):
+        """Return the cache holding system_instruction, creating or renewing it if needed, or None if not cached."""
+        if not system_instruction or estimate_tokens(system_instruction) < context_cache_min_tokens:
+            return None
+
+        key = (model_name, hashlib.sha256(system_instruction.encode()).hexdigest())
+        with self.lock:
+            cache, expire_time = self.caches.get(key, (None, None))
+            now = datetime.now(timezone.utc)
+            ttl = timedelta(minutes=context_cache_ttl_minutes)
+            # renew a bit before the expiration so a call never references an expired cache
+            if expire_time is None or expire_time - now < timedelta(minutes=1):
+                try:
+                    cache = self.create_cache(model_name, system_instruction, ttl)
+                except Exception as e:
+                    # don't try again before the TTL, the prompt is just sent in full meanwhile
+                    print(f"Could not cache the system instruction: {e}")
+                    cache = None
+                self.caches[key] = (cache, now + ttl)
+            return cache
+
+    def generate(self, user_input, system_instruction, model_name, generation_config, safety_settings, on_chunk=None,
+                 usage=None):
+        cache = self.get_cache(model_name, system_instruction)
+        text, prompt_tokens, cached_tokens, response_tokens = self.generate_content(
+            cache, user_input, system_instruction, model_name, generation_config, safety_settings, on_chunk)
+        if usage is not None:
+            usage.add(prompt_tokens, cached_tokens, response_tokens)
+        return text
+
+    def warm_up(self):
+        pass
+
+    def create_cache(self, model_name, system_instruction, ttl):
+        raise NotImplementedError
+
+    def generate_content(self, cache, user_input, system_instruction, model_name, generation_config, safety_settings,
+                         on_chunk):
+        """Return (response text, prompt tokens, cached prompt tokens, response tokens)."""
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self):
+        super().__init__()
+        # models bound to a cache, by (cache name, generation config, safety settings)
+        self.cached_models = {}
+
+    def warm_up(self, model_name="gemini-1.5-pro-002"):
+        """Open the connection to Gemini with a cheap call, so the first real request doesn't pay for it."""
+        model = get_model(model_name, freeze_settings(default_generation_config), None,
+                          freeze_settings(default_safety_settings))
+        model.count_tokens("Bonjour")
+
+    def create_cache(self, model_name, system_instruction, ttl):
+        return caching.CachedContent.create(model=model_name, system_instruction=system_instruction, ttl=ttl)
+
+    def generate_content(self, cache, user_input, system_instruction, model_name, generation_config, safety_settings,
+                         on_chunk):
+        if cache is None:
+            model = get_model(model_name, generation_config, system_instruction, safety_settings)
+        else:
+            key = (cache.name, generation_config, safety_settings)
+            with self.lock:
+                if key not in self.cached_models:
+                    self.cached_models[key] = genai.GenerativeModel.from_cached_content(
+                        cached_content=cache, generation_config=dict(generation_config),
+                        safety_settings=[dict(setting) for setting in safety_settings])
+                model = self.cached_models[key]
+
+        if on_chunk:
+            chunks = []
+            response = model.generate_content(user_input, stream=True,
+                                              request_options={'timeout': generation_timeout})
+            for chunk in response:
+                on_chunk(chunk.text)
+                chunks.append(chunk.text)
+            text = ''.join(chunks)
+        else:
+            response = model.generate_content(user_input, request_options={'timeout': generation_timeout})
+            text = response.text
+        usage_metadata = response.usage_metadata
+        return (text, usage_metadata.prompt_token_count, usage_metadata.cached_content_token_count,
+                usage_metadata.candidates_token_count)
 
 
-import discord
-from datetime import datetime, timedelta, timezone
+class FakeBackend(LLMBackend):
+    """Offline backend answering a canned response after a delay, to test and measure without calling Gemini."""
 
+    def __init__(self, latency=0.0, response="* 1 gaiarkhè, NONE"):
+        super().__init__()
+        self.latency = latency
+        self.response = response
+        # (model name, system instruction) of every cache created
+        self.created_caches = []
 
-async def split_messages_by_hours(messages, hours_split):
-    """Split messages into two lists: one from the first hours_split hours and the other with the rest."""
+    def create_cache(self, model_name, system_instruction, ttl):
+        self.created_caches.append((model_name, system_instruction))
+        return f"cachedContents/fake-{len(self.created_caches)}"
 
-    # Get the current time in UTC
-    now = datetime.now(timezone.utc)
+    def generate_content(self, cache, user_input, system_instruction, model_name, generation_config, safety_settings,
+                         on_chunk):
+        time.sleep(self.latency)
+        if on_chunk:
+            for line in self.response.splitlines(keepends=True):
+                on_chunk(line)
+        cached_tokens = estimate_tokens(system_instruction) if cache else 0
+        prompt_tokens = estimate_tokens(system_instruction or '') + estimate_tokens(user_input)
+        return self.response, prompt_tokens, cached_tokens, estimate_tokens(self.response)
 
-    # Calculate the time threshold for hours_split (e.g., 48 hours ago)
-    time_threshold = now - timedelta(hours=hours_split)
 
-    # Lists to store split messages
-    first_list = []
-    second_list = []
+# "gemini", or "fake" to answer canned responses after FAKE_LLM_LATENCY seconds without calling any API
+if os.getenv('LLM_BACKEND', 'gemini') == 'fake':
+    llm_backend = FakeBackend(float(os.getenv('FAKE_LLM_LATENCY', '0')))
+else:
+    llm_backend = GeminiBackend()
 
-    # Iterate over the messages
-    for message in messages:
-        if message.created_at > time_threshold:
-            # Message is within the first hours_split hours
-            first_list.append(message)
-        else:
-            # Message is older than hours_split
-            second_list.append(message)
 
-    return first_list, second_list
+def generate_response(user_input, system_instruction, model="gemini-1.5-pro-002", generation_config=None,
+                      safety_settings=None, on_chunk=None, usage=None):
+    """Generate a response with the configured backend.
+
+    If on_chunk is given, the response is streamed and each chunk of text is passed to it as soon as it is generated.
+    If usage is given, the input tokens of the call are added to it.
+    """
+    return llm_backend.generate(user_input, system_instruction, model,
+                                freeze_settings(generation_config or default_generation_config),
+                                freeze_settings(safety_settings or default_safety_settings), on_chunk, usage)
+
+
+# number of Gemini calls that can run at the same time, each one in its own worker thread
+generation_workers = int(os.getenv('GENERATION_WORKERS', '4'))
+generation_executor = ThreadPoolExecutor(max_workers=generation_workers, thread_name_prefix="gemini")
+
+
+# number of seconds a Gemini call can take before it's given up
+generation_timeout = float(os.getenv('GENERATION_TIMEOUT', '300'))
+
+# number of times a failed or timed out Gemini call is retried, and maximum number of seconds to wait before a retry
+generation_retries = int(os.getenv('GENERATION_RETRIES', '3'))
+generation_max_backoff = float(os.getenv('GENERATION_MAX_BACKOFF', '30'))
+
+# a duplicate of a call is sent when it runs longer than this percentile of the recent calls to the same model,
+# the first response is used, 0 disables it
+generation_hedge_percentile = float(os.getenv('GENERATION_HEDGE_PERCENTILE', '95'))
+
+# number of recent calls needed before hedging, the percentile means nothing before
+hedge_min_samples = 20
+
+# durations of the last successful calls, by model
+generation_latencies = defaultdict(lambda: deque(maxlen=200))
+
+# rate limits, server errors and timeouts are worth retrying, invalid requests are not
+retryable_generation_errors = (google_exceptions.TooManyRequests, google_exceptions.ServerError, TimeoutError,
+                               ConnectionError)
+
+
+def hedge_delay(model):
+    """Return after how many seconds a call to model is hedged, or None if it's not."""
+    latencies = generation_latencies[model]
+    if not generation_hedge_percentile or len(latencies) < hedge_min_samples:
+        return None
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * generation_hedge_percentile / 100))]
+
+
+async def generate_response_async(user_input, system_instruction, **kwargs):
+    """Run generate_response in a worker thread so the discord event loop keeps running during the call.
+
+    Failed and timed out calls are retried after a jittered exponential backoff.
+    """
+    for retries in itertools.count(1):
+        try:
+            return await generate_hedged(user_input, system_instruction, **kwargs)
+        except retryable_generation_errors as e:
+            if retries > generation_retries:
+                raise
+            delay = min(generation_max_backoff, 2 ** retries) * random.uniform(0.5, 1)
+            print(f"Gemini call failed ({e!r}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def generate_hedged(user_input, system_instruction, **kwargs):
+    """Make a call within generation_timeout seconds, sending a duplicate if it's slower than usual.
+
+    The clock starts when a worker thread picks the call up, waiting for a free worker doesn't count.
+    """
+    loop = asyncio.get_running_loop()
+    model = kwargs.get('model')
+    started = loop.create_future()
+    # set once the call is answered or given up, an attempt picked up by a worker after that is skipped
+    settled = threading.Event()
+
+    def call():
+        if settled.is_set():
+            raise asyncio.CancelledError
+        start = time.monotonic()
+        loop.call_soon_threadsafe(lambda: started.done() or started.set_result(start))
+        response = generate_response(user_input, system_instruction, **kwargs)
+        settled.set()
+        generation_latencies[model].append(time.monotonic() - start)
+        return response
+
+    def start_attempt():
+        attempt = loop.run_in_executor(generation_executor, call)
+        # the error of an attempt that lost the race is not interesting
+        attempt.add_done_callback(lambda future: future.cancelled() or future.exception())
+        return attempt
+
+    attempts = {start_attempt()}
+    try:
+        start = await started
+        delay = hedge_delay(model)
+        if delay is not None and delay < generation_timeout:
+            done, _ = await asyncio.wait(attempts, timeout=start + delay - time.monotonic())
+            if not done:
+                print(f"Gemini call slower than {delay:.1f}s, sending a duplicate")
+                attempts.add(start_attempt())
+
+        error = None
+        while attempts:
+            done, attempts = await asyncio.wait(attempts, timeout=start + generation_timeout - time.monotonic(),
+                                                return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"Gemini didn't answer in {generation_timeout:.1f}s")
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+    finally:
+        settled.set()
+        # attempts still waiting for a worker are dropped, the running ones can't be interrupted and are freed by
+        # the request timeout given to Gemini
+        for attempt in attempts:
+            attempt.cancel()
+
+
+async def stream_response_async(user_input, system_instruction, **kwargs):
+    """Async generator yielding the chunks of a streamed response as they are generated in the worker thread."""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def on_chunk(text):
+        loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+    future = loop.run_in_executor(generation_executor, functools.partial(
+        generate_response, user_input, system_instruction, on_chunk=on_chunk, **kwargs))
+    # chunks are always queued before this runs, so None marks the end of the stream
+    future.add_done_callback(lambda _: chunks.put_nowait(None))
+    while (chunk := await chunks.get()) is not None:
+        yield chunk
+    # re-raise the error of the call, if any
+    await future
+
+
+import aiohttp
+import discord
+from datetime import date, datetime, timedelta, timezone
+
+
+async def split_messages_by_hours(messages, hours_split, now):
+    """Split messages sorted by id into two lists: one from the hours_split hours before now and the other with the
+    rest."""
+
+    # The first snowflake possible hours_split hours ago (e.g., 48 hours ago)
+    split_id = discord.utils.time_snowflake(now - timedelta(hours=hours_split))
+
+    # Binary search on the snowflakes instead of comparing every timestamp
+    split_index = bisect.bisect_left(messages, split_id, key=lambda message: message.id)
+    return messages[split_index:], messages[:split_index]
 
 
 # Your Discord token here (user token from the browser's developer tools)
@@ -95,18 +406,44 @@ first_day = datetime(2022, 9, 1)
 # Gaiartian months
 months = ["Gaiarkhè", "Tempopidum", "Quinésil", "Éposendre"]
 
-hours_to_summarize = int(os.getenv('HOURS_OF_CONTEXT'))
-context_hours = int(os.getenv('HOURS_TO_SUMMARIZE').strip())
-
-def calculate_gaiartian_date(input_date: str):
-    """Convert real-world date into custom Gaiartian date format."""
-    try:
-        date = datetime.strptime(input_date, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        return "Invalid date format. Please use %Y-%m-%d %H:%M:%S"
-
+# ids of the channels to summarize, separated by commas
+channel_ids = [int(channel_id) for channel_id in
+               os.getenv('CHANNEL_IDS', '718824042685136936,1017475737852317768').split(',')]
+
+# maximum number of channel histories fetched at the same time. Each channel has its own discord rate limit
+# bucket for message history, so this mostly keeps us under the global rate limit when many channels are configured
+max_concurrent_fetches = int(os.getenv('MAX_CONCURRENT_FETCHES', '4'))
+history_fetch_semaphore = asyncio.Semaphore(max_concurrent_fetches)
+
+hours_to_summarize = int(os.getenv('HOURS_TO_SUMMARIZE').strip())
+context_hours = int(os.getenv('HOURS_OF_CONTEXT').strip())
+
+# ordinal of the day of the unix epoch, to turn snowflakes into days without building datetimes
+unix_epoch_ordinal = date(1970, 1, 1).toordinal()
+
+
+def real_day(moment):
+    """Return the UTC calendar day of a datetime (naive ones are taken as UTC), a snowflake, or a
+    "%Y-%m-%d %H:%M:%S" string."""
+    if isinstance(moment, int):
+        # the snowflake holds its timestamp in milliseconds since the discord epoch
+        return date.fromordinal(unix_epoch_ordinal + ((moment >> 22) + discord.utils.DISCORD_EPOCH) // 86400000)
+    if isinstance(moment, str):
+        moment = datetime.strptime(moment, "%Y-%m-%d %H:%M:%S")
+    if isinstance(moment, datetime):
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+        return moment.date()
+    if isinstance(moment, date):
+        return moment
+    raise TypeError(f"Can't convert {moment!r} to a Gaiartian date")
+
+
+@functools.lru_cache(maxsize=4096)
+def gaiartian_date_of_day(day):
+    """Convert a real-world calendar day into its Gaiartian (year, day, month)."""
     # Calculate the number of months since the first day
-    n_months_since_first_day = (date.year - first_day.year) * 12 + (date.month - first_day.month)
+    n_months_since_first_day = (day.year - first_day.year) * 12 + (day.month - first_day.month)
 
     # Calculate the Gaiartian year
     year = (n_months_since_first_day // 4) + 1
@@ -114,972 +451,1732 @@ def calculate_gaiartian_date(input_date: str):
         year -= 1  # There is no year 0 in the Gaiartian calendar
 
     # Calculate the Gaiartian month
-    month_index = (date.month - 1) % len(months)
+    month_index = (day.month - 1) % len(months)
     month = months[month_index]
 
-    # Extract the day
-    day = date.day
+    # Return the components separately for flexible formatting
+    return year, day.day, month
 
-    # Return the Gaiartian date as a formatted string
-    return year, day, month  # Return the components separately for flexible formatting
 
+def calculate_gaiartian_date(moment):
+    """Convert a real-world date (see real_day for the accepted types) into its Gaiartian (year, day, month).
 
-class MyClient(discord.Client):
-    async def on_ready(self):
-        print('Logged on as', self.user)
+    Raises ValueError or TypeError on invalid input.
+    """
+    return gaiartian_date_of_day(real_day(moment))
 
-    async def on_message(self, message: Message):
-        # check if the message is from the controller id or the bot if allowed
-        if (can_bot_control_itself and message.author.id == self.user.id) or (
-                str(message.author.id) == str(controller_id)):
-            if str(message.channel.id) == str(controller_channel_id):
-                if message.content == "$summarize":
-                    summary = await self.summarize(message)
-                if message.content == "$journal":
-                    summary = await self.journal(message)
 
-    async def get_messages_since_last_x_hours(self, channel_id, hours):
-        """Fetch and return all messages in a specific channel from the last X hours."""
-        channel = self.get_channel(channel_id)
-        if not channel:
-            print(f"Channel with ID {channel_id} not found.")
-            return []
+def calculate_gaiartian_dates(moments):
+    """Convert a whole list of dates at once, each distinct calendar day being converted only once."""
+    return [gaiartian_date_of_day(real_day(moment)) for moment in moments]
 
-        # Calculate the time threshold (X hours ago) and make it timezone-aware in UTC
-        time_threshold = datetime.now(timezone.utc) - timedelta(hours=hours)
 
-        # List to store messages (raw)
-        all_messages = []
+def gaiartian_day_to_utc_range(year, month, day):
+    """Return the (start, end) UTC datetimes of a Gaiartian day, end excluded. month is a name of months."""
+    if year == 0:
+        raise ValueError("There is no year 0 in the Gaiartian calendar")
+    month_index = [name.lower() for name in months].index(month.lower())
 
-        # Fetch the messages from most recent to oldest
-        async for message in channel.history(limit=None):  # limit=None fetches all available messages
-            if message.created_at < time_threshold:
-                break
-            all_messages.append(message)
+    # Number of months since the first day, the reverse of gaiartian_date_of_day
+    n_months_since_first_day = ((year - 1) if year > 0 else year) * len(months) + month_index
+    real_year, real_month = divmod(first_day.year * 12 + first_day.month - 1 + n_months_since_first_day, 12)
+    real_month += 1
+    if not 1 <= day <= calendar.monthrange(real_year, real_month)[1]:
+        raise ValueError(f"{month} of year {year} has no day {day}")
 
-        # Reverse the list to make it from oldest to newest
-        all_messages.reverse()
+    start = datetime(real_year, real_month, day, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
 
-        return all_messages
 
-    async def format_message(self, message):
-        """Format a single message with username, Gaiartian date, and content, replacing mentions."""
-        content = message.content
+# user (<@id>, <@!id>), role (<@&id>) and channel (<#id>) mentions
+mention_pattern = re.compile(r"<(@!|@&|@|#)(\d+)>")
 
-        # Replace user mentions with actual usernames
-        for user in message.mentions:
-            content = content.replace(f'<@{user.id}>', f'@{user.display_name}')
+# maximum number of user, role and channel names kept in memory
+name_cache_size = int(os.getenv('NAME_CACHE_SIZE', '10000'))
 
-        # Replace channel mentions with actual channel names
-        for channel in message.channel_mentions:
-            content = content.replace(f'<#{channel.id}>', f'#{channel.name}')
 
-        # Convert message.created_at to a string format to use in Gaiartian date conversion
-        message_time_str = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
+class NameCache:
+    """LRU cache of the names of users, roles and channels, keyed by (mention kind, id), shared across runs."""
 
-        # Get Gaiartian date components (year, day, month)
-        year, day, month = calculate_gaiartian_date(message_time_str)
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.names = OrderedDict()
 
-        # Get the time part (hours, minutes, seconds)
-        time_part = message.created_at.strftime("%H:%M:%S")
+    def get(self, key):
+        name = self.names.get(key)
+        if name is not None:
+            self.names.move_to_end(key)
+        return name
 
-        # Format message in "[An X, le DAY de month_name à time]: message content" format
-        formatted_message = f"{message.author.display_name} [An {year}, le {day} de {month} à {time_part}]:\n{content}"
+    def put(self, key, name):
+        self.names[key] = name
+        self.names.move_to_end(key)
+        if len(self.names) > self.max_size:
+            self.names.popitem(last=False)
+
+
+name_cache = NameCache(name_cache_size)
+
+
+# number of times in a row a history walk is resumed after a rate limit or a connection error before giving up
+history_fetch_retries = int(os.getenv('HISTORY_FETCH_RETRIES', '8'))
+
+# maximum number of seconds to wait before resuming a history walk, when discord doesn't say how long to wait
+history_fetch_max_backoff = float(os.getenv('HISTORY_FETCH_MAX_BACKOFF', '60'))
+
+
+def history_retry_delay(error, retries):
+    """Return how long to wait before resuming a failed history walk, following discord's retry hint if any."""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None and isinstance(error, discord.HTTPException) and error.status == 429:
+        retry_after = float(error.response.headers.get('Retry-After', 0)) or None
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    # exponential backoff with jitter
+    return min(history_fetch_max_backoff, 2 ** retries) * random.uniform(0.5, 1)
+
+
+# path of the local SQLite archive where fetched messages are kept between runs
+archive_path = os.getenv('ARCHIVE_PATH', 'archive.db')
+
+
+def group_messages_by_gaiartian_day(messages_by_channel):
+    """Bucket messages by Gaiartian day, returning {(year, day, month): {channel_name: messages}} chronologically."""
+    days = {}
+    for channel_name, messages in messages_by_channel.items():
+        message_days = calculate_gaiartian_dates([message.created_at for message in messages])
+        for message, day in zip(messages, message_days):
+            days.setdefault(day, {}).setdefault(channel_name, []).append(message)
+
+    return dict(sorted(days.items(), key=lambda item: (item[0][0], months.index(item[0][2]), item[0][1])))
 
-        return formatted_message
 
-    async def summarize(self, message):
-
-        # Fetch raw messages for géopolitique channel
-        messages_géopolitique = await self.get_messages_since_last_x_hours(718824042685136936, context_hours)
-        # Split messages into those to summarize and context messages
-        messages_to_summarize_géopolitique, messages_as_context_géopolitique = await split_messages_by_hours(
-            messages_géopolitique, hours_to_summarize)
-        # Format messages after splitting
-        messages_to_summarize_géopolitique = [await self.format_message(m) for m in
-                                              messages_to_summarize_géopolitique]
-        messages_as_context_géopolitique = [await self.format_message(m) for m in
-                                            messages_as_context_géopolitique]
-
-        # Fetch raw messages for annonces channel
-        messages_annonces = await self.get_messages_since_last_x_hours(1017475737852317768, context_hours)
-        # Split messages into those to summarize and context messages
-        messages_to_summarize_annonces, messages_as_context_annonces = await split_messages_by_hours(
-            messages_annonces,
-            hours_to_summarize)
-        # Format messages after splitting
-        messages_to_summarize_annonces = [await self.format_message(m) for m in
-                                          messages_to_summarize_annonces]
-        messages_as_context_annonces = [await self.format_message(m) for m in messages_as_context_annonces]
-
-        system_message = f"""Tu seras un Agent dont le but est de résumé des évènements de salons RPs d'un salon discord dans un format tel que les résumés puissent être automatiquement ajoutés à une page fandom. Le serveur discord est le serveur discord d'un serveur minecraft nommé LaBoulangerie qui est un serveur géopolitique semi-rp. Tu résumeras le contenu du salon #géopolitique qui est le salon pour rp et faire de la géopolitique, mais tu résumeras aussi le salon #annonces qui est le salon des annocnes rp et géopolitiques, des villes, nations, entreprises, roganisations, joueurs etc... Tu seras donné la liste des messages des {hours_to_summarize} dernières heures à résumés. Chaque message aura son auteur, sa date, et son contenu textuel. Tu seras aussi donné en contexte, les messages des 7 précédents jours, mais eux ne seront pas à résumés, résume seulement ceux des {hours_to_summarize} (qui te seront donnés séparemment."
-    Le format d'un message sera 'author_name [date]: message_content' with [date] being in the format [An X, le DAY_NUMBER de CUSTOM_MONTH_NAME à TIME_IN_HOURS_MINUTES_SECONDS] parce que oui Gairtos utilise seulement 4 mois customs : Gaiarkhè, Tempopidum, Quinésil, Éposendre
-    Dans le Fandom, chaque An a sa propre page, et dedans à un moment il y a les évènements dans un ordre chronologique. Je vais te donner comme example le wikicode de la page de l'An 4 , regarde bien comment il est formatté. Tu devras seulement créer des tirets pour des évèhnements à des dates. Tu devras faire un tiret (et donc résumé) par jour donné, voici le wikicode complet de la page :
-    L''''an 4''' est une année tertiaire du Calendrier Gaiartois qui commence un vendredi. Elle fait suite à l'[[an 3]] et précède l'[[an 5]].
-
-    Elle correspond à l'an 2003 du [[Calendrier Panimorphe]] et les mois de septembre à décembre 2023 du [[Calendrier Minecraftien]].
-    ```
-    ==Événements==
-    ===Gaiarkhè===
-
-    * 6 gaiarkhè, [[Kætern d'Ange]] fonde [[Dolivageä]].
-    * 9 gaiarkhè, [[Dolivageä]] adopte la [[:Fichier:Bannière de Dolivageä.png|Bannière de Dolivageä]].
-    * 10 gaiarkhè, [[Algard]] cède une partie de ses terres du nord à [[Dolivageä]] suite à un entretien entre [[Valgard Arkisson|Valgard Arkinsson]] et [[Kætern d'Ange]].
-    * 16 gaiarkhè
-    ** [[Dolivageä]] adopte le [[:Fichier:Blason de Dolivageä.png|Blason de Dolivageä]].
-    ** [[Dolivageä]] inaugure le [[Temple du Rubis]] et annonce sa participation au [[concours de patrimoine]] de la [[Panitropole]].
-    * 17 gaiarkhè
-    ** [[Red 1er|Red Ier]] et [[Kætern d'Ange]] signent le [[Traité de Dolivageä]].
-    ** [[Kætern d'Ange]] fonde le [[Duché de Dolivageä]] qui adopte la [[:Fichier:Bannière de Dolivageä.png|Bannière]] et le [[:Fichier:Blason de Dolivageä.png|Blason de Dolivageä]].
-    *21 gaiarkhè, le [[Duché de Dolivageä]] et sa [[Dolivageä|préfecture]] adoptent leur devise officielle « [[Nos louanges se chantent en Arthos]] ».
-    * 28 gaiarkhè, [[Dolivageä]] et [[Cushy]] inaugurent [[le Prismarin]].
-
-    ===Tempopidum===
-
-    * 1ᵉʳ tempopidum
-    ** [[PainOraisins]] décode l'énigme de [[Fryzhen]].
-    ** [[Léonard Vizzini]] meurt dans un attentat commis, selon [[Goldcrest]], par des militants [[Familisme|familistes]].
-    ** [[Adrian Hartmann]] publie l'essai [[Réflexion sur l'Illusion du Bien Commun]].
-    ** Le [[Nalvarune|Royaume de Nalvarune]] adopte un régime oligarchique, [[Sir Matthew Percival Norrington|Matthew Norrington]], [[François LeNoble]] et [[Valérian "Caesar" Nerona|Valérian Nerona]] sont nommés [[Oligarque de Nalvarune|oligarques de Nalvarune]].
-    *3 tempopidum
-    **Le [[Petit Gaiartois]] publie le dixième numéro de [[Petit Gaiartois (journal)|son hebdomadaire]].
-    **[[Zagrivocha]] répond à l'annonce de l'assassinat de [[Léonard Vizzini]] en la remettant en cause et en condamnant l'attentat, et dénonce le traitement de l'affaire par le [[Petit Gaiartois]].
-    *5 tempopidum
-    **Le [[Petit Gaiartois]] répond à la réponse de [[Zagrivocha]] en la traitant comme une menace, annonce une édition spéciale sur les [[attentats des routes du Nether]] et lance un sondage sur l'augmentation du prix de [[Petit Gaiartois (journal)|son hebdomadaire]].
-    **[[Zagrivocha]] répond de nouveau au [[Petit Gaiartois]] en expliquant ne pas la menacer.
-    * 10 tempopidum, le [[Petit Gaiartois]] publie le onzième numéro de [[Petit Gaiartois (journal)|son hebdomadaire]].
-    * 11 tempopidum
-    ** [[Marc Lèone]] fonde l'[[Île-Croissant Souveraine]] sur l'[[Île-Croissant|île éponyme]] ou s'installe la [[Congrégation de la Chape|Congrégation de la Chappe]] après avoir pillé une partie des ressources d'[[Annales d'Augolia|Augolia]].
-    ** Le [[Parti Kæterniste]], dans le cadre de son combat contre le [[familisme]], publie l'[[affiche anti-familiste]] qu'elle fait mettre en vente à l'aide de la [[Fondation d'Ange]]. Il annonce travailler sur une proposition de premier [[Code Pénal du Royaume de Goast]], où serait interdit la « propagation des idées familistes ».
-    *12 tempopidum
-    **[[Kætern d'Ange]] lance le premier appel d'offre pour le chantier du [[Château de Dolivageä]].
-    **[[Ludovicus Ventor]] érige la route entre [[Cushy]] et [[Nalvarune]].
-    **[[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] fonde le [[Parti Capitaliste Gaiartois]].
-    **[[Giga Zeus]] rend publique son usine à trident.
-    *13 tempopidum
-    **[[MMMOK]] pille [[Osharia]] puis rejoint [[Nalvarune]].
-    **[[Nalvarune]] adopte la [[Constitution de Nalvarune]].
-    **[[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] annonce les avancées de l'enquête sur l'[[Assassinat de Léonard Vizzini]], les auteurs du meurtre semblent décédés et d'origines [[Annales d'Augolia|augoloises]].
-    *14 tempopidum
-    **[[MMMOK]] pille [[Nalvarune]] avant de se faire tuer par [[Lengevin]].
-    **[[Friolon|Friolon d'Orion]] organise la [[Congrégation des Marchands de Damield]] a [[Osterces]].
-    *15 tempopidum
-    **[[Kætern d'Ange]] trouve le cadavre de [[Tortamor]] et les [[journaux de Maximus]] après l'annonce de [[Cushy]]. Il y rencontre [[Maximus Maledictio]] et s'engage dans un combat avec, il finira par fuir avec les journaux en voyant la puissance de Maximus.
-    **[[Maximus Maledictio]] attaque les [[routes du Nether]] avec une armée de withers, il y rencontre [[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] qu'il tue lors d'un combat.
-    **Un inconnu rase la fontaine du [[Cushy|quartier pauvre de Cushy]] lors d'une réunion au [[Panitropole|forum de la Panitropole]].
-    **[[Endafyr Quamat]] annonce le repos de [[Kætern d'Ange]] à [[Cushy]] suite à une blessure subie lors de son combat contre [[Maximus Maledictio]].
-    *16 tempopidum
-    **[[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II]] devient maire de [[Goldcrest]].
-    **Le [[Nalvarune|Royaume de Nalvarune]] modifie sa constitution pour y ajouter l'article concernant la Chancelière.
-    **[[Gabrielle de Marliave]] est nommée Chancelière du [[Nalvarune|Royaume de Nalvarune]] par les Oligarques.
-    **Le [[Nalvarune|Royaume de Nalvarune]] met en place sa vigilance attentat suite à l'[[attaque de Maximus Malédictio]].
-    *18 tempopidum, [[Maximus Maledictio|Maximus Malédictio]] fait quelques apparitions à [[Zagrivocha]] et [[Nalvarune]].
-    *20 tempopidum
-    **[[Adrian Hartmann]] annonce chercher un emplacement pour l'[[Université de Clover]].
-    **La [[Fondation d'Ange]] met en place le Fond Solimiste.
-    *23 tempopidum
-    **Osterces inaugure la Bibliothèque de la Congrégation de la Chape.
-    **[[Maximus Maledictio]] fait une apparition à [[Annales d'Augolia|Augolia]].
-    *24 tempopidum, le [[Petit Gaiartois]] publie le douzième numéro de [[Petit Gaiartois (journal)|son bihebdomadaire]].
-    *25 tempopidum
-    **Le [[Duché de Dolivageä]] inaugure le [[Pont Louis-Philippe Ier]] et la route entre [[Dolivageä]] et les [[ruines d'Asgardia]].
-    **[[Nalvarune]] entame des fouilles archéologiques à son lac.
-    **[[Valgard Arkisson|Valgard Arkinsson]] expose ses deux premières gravures a [[Algard]].
-    *27 tempopidum, [[Louis-Philippe Vizzini II]] fonde la [[Vizzini Print]].
-    *30 tempopidum [[Maximus Maledictio]] fait une apparition à [[Hernebhes des Solimes|Solimé]], par la suite, il tue [[Matzepol]], le meurtre est dénoncé par [[Nalvarune]] dans la foulée.
-    *31 tempopidum, [[Cushy]] met la tête de [[Maximus Maledictio]] à prix.
-    ===Quinésil===
-
-    * 1er quinésil, [[Osterces]] inaugure la [[Tour d'Yggdrasil]].
-    * 2 quinésil, [[Osterces]] inaugure le [[café de l'Antique]].
-    * 3 quinésil, [[Osterces]] inaugure la route la reliant aux [[ruines d'Asgardia]].
-    * 4 quinésil
-    ** [[Revax]] fonde le parti des [[Partageurs Gaiartois Unis]] et distribue des tracs exposant son programme et annonçant vouloir détruire les symboles du [[Royaume de Goast]] dont les routes, ce tract provoque une polémique au sein du Royaume.
-    ** [[Dolivageä]] proclame hors-la-loi [[Revax]] et [[le Vagabond]] pour leur proximité avec l'idéologie [[Familisme|familiste]].
-    ** La résidence [[Le Vagabond|du Vagabond]] a [[Solimé]] est perquisitionnée par les autorités goasts.
-    ** [[Bidouille Dierne]] fonde la [[Bidouille Building Company]].
-    ** La [[Société Vizzini]] organise une soirée d'inauguration pour son restaurant le [[Vizzini d'Or]].
-    ** Le [[Nalvarune|Royaume de Nalvarune]] annonce avoir décodé les messages de [[Maximus Maledictio]].
-    ** La résidence de [[Revax]] a [[Solimé]] est perquisitionnée par les autorités goasts.
-    *6 quinésil - [[Le Renard]] mène un coup d'état dans [[la retraite du Démon]] qu'il réussi et assassine [[Bleu Azure]].
-
-    ===Éposendre===
-    ```
-
-    Je le répète, toi devras juste ajouté des dates individuelles, et si besoin les évènements individuels. Car un résumé d'un jour peut avoir plusieurs choses (c'est même probable).
-    Le type d'évènement doit être un minimum important, comme tu le vois ici.
-    Voici d'autres examples de pages d'An pour que tu comprennes quels types d'évènements sont gardés :
-    ```
-    L''''an 5''' est une année tertiaire du [[Calendrier Gaiartois]] qui commence un vendredi. Elle fait suite à l'[[an 4]] et précède l'[[an 6]].
-
-    Elle correspond à l'an 2004 du [[Calendrier Panimorphe]] et les mois de janvier à avril 2024 du [[Calendrier Minecraftien]].
-    ==Événements==
-    ===Gaiarkhè===
-
-    * 2 gaiarkè, le [[Shade]] annonce la tenue du duel entre lui-même et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]].
-    *6 gaiarkhè
-    **[[Royaume de Goast|Goast]] rend son indépendance à [[Veltea]].
-    **[[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] bat le [[Shade]] en duel dans le cadre du [[Shade#Légende du Cristal (Depuis le 22 éposendre de l'an 4)|Défi du Shade]].
-    *7 gaiarkhè
-    **[[Veltea]] s'effondre et [[Algard]] en prend le contrôle créant une polémique.
-    **[[Végétalia]] s'effondre.
-    *8 gaiarkhè, [[Algard]] cède le contrôle de [[Veltea]].
-    *9 gaiarkhè
-    **[[Alster]] prend le contrôle de [[Veltea]].
-    **[[Kætern d'Ange]] annonce la tenue d'enchères au [[Château de Dolivageä]].
-
-    *14 gaiarkhè, création de la Fédération Familiste de Brulfroï après un rapprochement entre les deux pays de Kappi et de Zagrivocha.
-    *20 gaiarkhè
-    **Enchères à [[Dolivageä|Dolivagëa]]. Le [[royaume de Goast]] accuse [[Royaume de Nalvarune|Nalvarune]] d'avoir menti sur la rareté des dromadaires vendus ainsi que [[Vindicta]] d'avoir manipulé les prix en surenchérissant les lots<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1198681122247286804|Annonce officielle du 21 janvier]]</ref>.
-    **[[Ormick Ier|Ormick I<sup>er</sup>]] prend le trône vacant à [[Vicciopolis]] et dans la [[coprincipauté d'Hybloniopolis]], confirmant l'union personnelle entre les deux cité-États.
-
-    * 24 gaiarkhè, érection d'une première Grande Tour Magique de Gaiartos, l'Aegeria, à Osterces.
-
-    *26 gaiarkhè, inauguration de la bibliothèque à [[Cushy]].
-
-    ===Tempopidum===
-
-    *3 tempopidum, [[Jorvik]] (aujourd'hui Poséage) rejoint le [[royaume de Goast]] pour la commémoration des 1 an de la fin de la [[Guerre des Quatre Armées]] dans le musée de [[Tharass]].
-    *11 gaiarkhè
-    **Début de la publication posthume de l'œuvre ''De la démocratie en Gaiartos'' de [[Mazer O’Shaw|Mazer O'Shaw]].
-    **Friolon II prend la relève après que le précédent souverain d'[[Osterces]] ait été tué dans des « circonstances douteuses »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1206304677335924776|Annonce de la ville d'Osterces]] du même jour :« C'est depuis Osterces, que je vous parle : moi, Friolon deuxième du nom, prend la relève de la direction de la ville. En effet, notre précédent souverain et fondateur est décédé en de douteuses circonstances.  » </ref>.
-
-    *12 gaiarkhè, le [[Azurentos|duché d'Azurentos]] déclare son indépendance du [[royaume de Nalvarune]], créant le [[royaume d'Astréa]], qui provoque une crise interne à Nalvarune.
-    *17 gaiarkhè, organisation du concours quadriennal de course des bateaux de glace dans la [[Fédération Familiste de Bulfroi|F.F.B.]]
-    *21 gaiarkhè, pousse de l'« Arbre de vie » à Algard sur lequel le Jarl a étendu sa résidence afin d'en apprendre davantage<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1209967995649007656|Annonce de la ville d'Algard]] du même jour</ref>.
-    *23 tempopidum, mariage entre [[Ormick Ier|Ormick I<sup>er</sup>]] et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] à [[Vicciopolis]].
-    *21 tempopidum, ouverture des candidatures pour l'élection des Grands Jurés du Comité des Brasseurs afin de revitaliser l'organisation<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1210219857090576437|Annonce du Comité]] le jour même</ref>.
-    *25 tempodidum, fondation du [[royaume de Crusentia]] avec le maire d'[[Osharia]], les titulaires des trônes d'[[Coprincipauté d'Hybloniopolis|Hybloniopolis]] et de [[Vicciopolis]] et le maire de la cité-État de [[Cushy]].
-    *25 tempopidum, naissance des enfants de [[Ormick Ier|Ormick I<sup>er</sup>]] et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] : Louis-Philippe Vizzini O'Shaw I<sup>er</sup> ''Junior'' et Emarant Vizzini O'Shaw I<sup>er</sup> ''Junior''
-    *28 tempopidum
-    **Aésultats des élections au [[Comité des Brasseurs]] : [[Nicolas Junlase]], [[Ruki tamashi|Ruki Tamashi]] et [[Ormick Ier|Ormick I<sup>er</sup>]] deviennent Grands Jurés.
-    **Abdication du [[Guillaume Verentti Garois|Guillaume Garois I<sup>er</sup>]] en faveur de son fils [[Gaëtan Guillaume Garois|Gaëtan Garois II]] qui monte sur le trône à [[Astréa]].
-
-    ===Quinésil===
-
-    *2 quinésil, nouvelles attaques sur les routes nétheresques.
-    *3 quinésil
-    **Mort de [[Nicolas Junlase]].
-    **Disparition de ReNouy, voleur connu.
-
-    *4 quinésil, 
-    **Azurentos commercialise de la vodka black et du vin lumineux, vente condamnée par le Comité des Brasseurs qui fait proposer la guerre contre Azurentos au Conseil Constitutionnel de Goast.<ref>https://discord.com/channels/516302751500599316/718824042685136936/1214185513477480468</ref>
-    **Création [[Rassemblement des Saveurs Brassicole]] par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]] en réponse à « [l'impossibilité] d'exploiter [ces] boisson[s] à moins d'en être le breveté »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1214009565323198484|Annonce officielle de l'organisation]]</ref>.
-    *6 quinésil, création de la [[guilde des Marchands]] par [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]].
-    *13 quinésil, annonce d'une collaboration entre le [[royaume de Goast]] et la [[Fédération Familiste de Bulfroi|F.F.B.]] pour la surveillance de l'exploitation des glaciers du nord, ainsi qu'une collaboration entre ce même royaume et la [[principauté d'Augolia]] pour revégétaliser et protéger l’environnement des [[Iles-de-Fer]].
-    *17 quinésil, tenue d'enchères pour l'inauguration du château de [[Tharass]].
-    *24 quinésil
-    **Effondrement de la ville du [[royaume de Nalvarune]] suite aux problèmes internes due aux sécessionnistes d'Azurentos.
-    **La famille royale excepté le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]] se retire pour construire une villégiature près de [[Nalvarune]] afin de protéger les ruines de la ville.
-    *29 quinésil
-    **Début de construction d'un quartier résidentiel à [[Osterces]].
-    **Signature du [[traité de Vicciopolis]] pour le libre échange entre le [[royaume de Goast]] et le [[royaume de Crusentia]].
-
-    ===Éposendre===
-
-    *1<sup>er</sup> éposendre
-    **Mort du roi [[Gaëtan Guillaume Garois|Guillaume Garois I<sup>er</sup>]] et explications de la nouvelle constitution du [[royaume d'Astréa]] avec un pouvoir monarchique absolu et un Sénat consultatif, ainsi que présentation du culte astréen.
-    **Canulars du 1<sup>er</sup> avril.
-    **Mariage de [[Red 1er|Red I<sup>er</sup>]] et [[Friolon|Magelion d'Orion II]] lors duquel l'ex-roi décède accidentellement. Création d'une journée nationale en [[Royaume de Goast|Goast]] et vague de soutiens internationaux lors de son annonce le 3 éposendre.
-    **Effondrement de [[Midgard]], qui est pillée par Algard puis les ressources de laquelle son rendue à son nouveau suzerain : [[Coprincipauté d'Hybloniopolis|Hybloniopolis]].
-
-    *2 éposendre, [[Tajir Pa'an]] déclare la [[Commune d'Azurentos]] tandis que la famille royale s'est absentée, commençant la [[crise azurentoise]].
-    *3 éposendre, création de la Légion étrangère gaiartoise par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]]
-    *4 éposendre, érection d'une statue en l'honneur du défunt Red I<sup>er</sup>.
-    *5 éposendre
-    **La couronne azurentoise déclare l'État d'urgence et la répression anti-insurrection.
-    **Annonce des échecs des pourparlers sous l'égide d'[[Industrial-Town]] entre les deux parties impliquées à cause du refus de la couronne azurentoise.
-
-    *6 éposendre, 
-    **La Panitropole appelle les gaiartois à l'aider pour construire un nouveau port, l'[[évent du port]].
-    **Propositions de pourparlers par la couronne azurentoise, refusée par [[Tajir Pa'an]].
-
-    *10 éposendre,
-    **Proposition de création de l'''Indestructi'Banque'' par [[Friolon|Magelion d'Orion II]].
-    **Cushy déclare revendiquer la presque intégralité des territoires anciennement détenus par le royaume de Nalvarune, à l'exception d'[[Elbor]] et Navæden.
-    **Passage sous la régence de [[Theopanos Templaris]], de la [[coprincipauté d'Augolia]], qui revendique les anciens territoires de Navæden.
-    *13 éposendre, 
-    **Tenue du [[Sommet d'Elbor]] lors duquel la [[crise navalraise]] est en partie résolue entre les différents revendicants du territoire.
-    **Proposition d'un dernier armistice par la couronne azurentoise, à nouveau refusée par [[Tajir Pa'an]].
-    **Le [[royaume de Goast]] propose des pourparlers entre les deux parties impliquées dans la [[crise azurentoise]].
-    **Proposition de création d'un tribunal gaiartois pour les futures crises.
-    **Attentat destructeur à Issy qui « rédui[t] [le port] en ruines. »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1229550592670568559|Annonce officielle]] du même jour :« Le port d'Issy, symbole de notre prospérité et de notre connexion au monde, a été gravement endommagé. Une partie de ses installations a été réduite en ruines, provoquant un effondrement brutal et radical. Des vies innocentes ont été perdues, des familles ont été dévastées, et notre cité toute entière est plongée dans le deuil. »</ref>
-
-    *16 éposendre, le [[duché de Dolivageä]] adopte par décret ''Louange du Duc'' comme son hymne officiel.
-    *17 éposendre, propositions de revendications maritimes par [[Ruki tamashi|Ruki Tamashi]], rejetées par une partie des gaiartois<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1230160196354052126|Annonce personnelle]] 5 réactions contre, 4 réactions pour</ref>.
-    *24 éposendre, publication des revendications de la tribus des Templaris, sous l'égide de la [[principauté d'Augolia]].
-    *25 éposendre, publication des revendications d'[[Elbor]].
-    *26 éposendre, publication des revendications d'Industrial-Town
-    *28 éposendre
-    **Tajir Pa'an se rend aux armées royales d'Azurentos ;
-    **Fondation de la Légion étrangère Gaiartoise par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois]].
-
-    <references />
-
-    ```
-
-    ```
-    L''''an 2''' est une année primaire du Calendrier Gaiartois qui commence un dimanche. Elle fait suite à l'[[an 1]] et précède l'[[an 3]].
-
-    Elle correspond à l'an 2001 du [[Calendrier Panimorphe]] et les mois de janvier à avril 2023 du [[Calendrier Minecraftien]].
-    ==Événements==
-    ===Gaiarkhè===
-
-    * 3 gaiarkhè, [[Bleu Azure]] fonde [[la retraite du Démon]].
-    * 4 gaiarkhè, [[Kætern d'Ange]] pille [[Frostbourne]] en profitant d'une manipulation de son maire.
-    * 16 gaiarkhè
-    ** [[Kætern d'Ange]] découvre la [[faille de Kætern]].
-    ** [[Kætern d'Ange]] termine son voyage à travers [[Gaiartos]].
-    ** [[Kætern d'Ange]] dévoile son premier tableau « [[:Fichier:Le voyage.png|Le Voyage]] ».
-    * 18 gaiarkhè, [[Kætern d'Ange]] perd sa main à la bataille de [[Naxos|Naxos-Ouest et Naxos-Est]].
-    * 21 gaiarkhè, [[Kætern d'Ange]] obtient sa [[première main en or]].
-
-    ===Tempopidum===
-
-    * 21 tempopidum, début des enchères de [[Kætern d'Ange]].
-    * 22 tempopidum, fin des enchères de [[Kætern d'Ange]].
-
-    ===Quinésil===
-
-    * 5 quinésil, la fortune de [[Kætern d'Ange]] dépasse les 500 000[[Fichier:PieceBriocheItem.png|16x16px]].
-    * 12 quinésil, naissance du [[Le Renard|Renard]].
-
-    ===Éposendre===
-
-    ```
-
-    ```
-    L''''an 1''' est une année tertiaire du Calendrier Gaiartois qui commence un jeudi. Elle fait suite au [[Ier siècle avant N.-C.|I<sup>er</sup> siècle avant N.C.]] et précède l'[[an 2]].
-
-    Elle correspond à l'an 2000 du [[Calendrier Panimorphe]] et les mois de septembre à décembre 2022 du [[Calendrier Minecraftien]].
-
-    == Événements ==
-
-    === Gaiarkhè ===
-
-    * 1 gaiarkhè, [[chute de la Panitropole]] au milieu des quatre continents de [[Gaiartos]].
-    * 9 gaiarkhè, '''fin de l'[[Époque intermédiaire|Époque Intermédiaire]].'''
-    * 10 gaiarkhè
-    ** '''Début de l'[[Âge du Renouveau]].'''
-    ** Début de la [[Nouvelle Colonisation]].
-    ** Création du [[Calendrier Gaiartois]].
-    ** [[Deltapythagore]] fonde [[Kappi|X-ray]] sur [[Bulfroï]].
-    ** [[Osharia]] est pillée et incendiée par les habitants d'[[Kappi|X-ray]].
-    ** [[Mazer O’Shaw|Mazer O'Shaw]] présente son idée de [[Ligue Gaiartoise]] dans une lettre ouverte.
-    * 11 gaiarkhè
-    ** [[Le Marchand]] fonde la [[tanière du Marchand]] sur [[Munakh]] a l'aide de sa fortune.
-    ** [[Le Marchand]] approuve l'idée de [[Ligue Gaiartoise]] de [[Mazer O’Shaw|Mazer O'Shaw]] dans une lettre ouverte.
-    ** [[Bossous]], [[Ludo]] et [[Mazer O’Shaw|Mazer O'Shaw]] fondent [[Midgard]] sur [[Damield]].
-    * 12 gaiarkhè la [[première pièce baguette]] depuis la [[Nouvelle Colonisation]] est frappée pour X-ray.
-    * 13 gaiarkhè
-    ** La [[ferme d'Ange]] est pillée et incendiée par les colons d'[[Etherington]].
-    ** [[Luïa d'Ange]], [[Oswald Quill]] et [[André d'Ange]] décèdent lors du pillage de la [[ferme d'Ange]].
-    * 14 gaiarkhè
-    ** [[Ptah]] fonde [[Ithil]] sur [[Damield]].
-    ** La Ligue Gaiartoise est fondée par la signature des Accords de la Panitropole par [[Perimars]], [[Mazer O’Shaw|Mazer O'Shaw]], [[Ptah]], [[Bossous]], [[Le Marchand]] et [[Deltapythagore]].
-    * 16 gaiarkhè
-    ** [[Perimars]] et [[Dreeems]] fondent [[Brouswell]] sur [[Nettai]].
-    ** La [[Panitropole]] reconnait [[Tharass]], ville de [[Damield]].
-    ** [[Vincentuque]] fonde [[Cacahuète Empire]] sur [[Damield]].
-    * 17 gaiarkhè
-    ** [[Mazer O’Shaw|Mazer O'Shaw]] et [[Pryzri Yzip]] fondent [[Coprincipauté d'Hybloniopolis|Hybloniopolis]] sur [[Damield]].
-    ** [[Cygale]] fonde [[Végétalia]] sur [[Damield]].
-    ** [[Giga Zeus]] et [[Ze Atom]] fondent Gigatom qu'ils renomment ensuite [[Jorvik]] sur [[Riquez]].
-    ** [[Pikachuz4]] fonde [[IndustrialTown]] sur [[Nettai]].
-    * 19 gaiarkhè
-    ** Un guerrier d'[[Kappi|X-ray]] tue un habitant de la [[tanière du Marchand]] lors d'un raid, [[Deltapythagore]] lance un ultimatum a la tanière dans la foulée, celui-ci est contesté par [[Coprincipauté d'Hybloniopolis|Hybloniopolis]], [[IndustrialTown]], [[Jorvik]] et la [[maison SangDragon]].
-    ** [[Le Marchand]] rencontre [[Red69 Leaf|Red Iᵉʳ]] lors d'une rencontre diplomatique.
-    ** La [[Panitropole]] reconnait [[Osharia]], ville de [[Munakh]].
-    ** [[Lui]] renverse la [[Primatie|Primatie Issienne]] d'[[Hisenhorn]] et prend le pouvoir à [[Issy]], ville de [[Munakh]].
-    * 20 gaiarkhè
-    ** [[Drago SangDragon]] fonde le [[Royaume d'Alésia]].
-    ** [[Kappi|X-ray]] attaque la [[tanière du Marchand]] lors de la [[Guerre des Deux-Heures]] et fini par défaire les défenses de la cité. [[Le Marchand]] et [[PainOraisins]] profitent de la défense pour faire évacuer les marchandises de la tanière qui se retrouve dissoute vers le [[Royaume d'Alésia]].
-    ** [[AltarusS]] décède en combattant pour la [[tanière du Marchand]] pendant la [[Guerre des Deux-Heures]].
-    ** [[Ludo]], habitant de la [[tanière du Marchand]], immigre vers [[Issy]].
-    ** [[Hyelbi]], habitant de la [[tanière du Marchand]], immigre vers [[Brouswell]].
-    ** La [[Ligue Gaiartoise]] exclut [[Kappi|X-ray]].
-    * 22 gaiarkhè
-    ** [[Drago SangDragon]] fonde [[GrainBeau]] sur [[Riquez]], elle devient la capitale du [[Royaume d'Alésia]].
-    ** [[Le Marchand]] et [[PainOraisins]] fondent [[Port-Angéis]] sur des ruines sous la tutelle du Royaume d'Alésia.
-    ** [[Cygale]] termine son exploration de [[Gaiartos]] et partage la [[Première carte de Gaiartos|première carte]] complète.
-    * 23 gaiarkhè, [[Bobbyllettrer]] et plusieurs autres habitants de [[Brouswell]] quitte la ville avec une partie de ses ressources pour fonder [[Azuria]] sur [[Bulfroï]].
-    * 24 gaiarkhè
-    ** [[Maximus Maledicto]] fonde [[Frostbourne]] sur [[Riquez]].
-    ** La première route inter ville depuis la [[Nouvelle Colonisation]] est érigée entre [[GrainBeau]] et [[Port-Angéis]] par le [[Royaume d'Alésia]].
-    * 25 gaiarkhè, [[Jorvik]] quitte le [[Royaume d'Alésia]].
-    * 27 gaiarkhè, la [[Panitropole]] reconnait [[Port-Angéis]], ville de [[Riquez]].
-    * 29 gaiarkhè
-    ** [[Oskey Ier]] fonde [[Etherington]] sur [[Damield]].
-    ** [[Spipsycoteck]] fonde [[Issy|Fer-Rouge]] sur [[Nettai]].
-    * 30 gaiarkhè
-    ** [[Spipsycoteck]] fonde le [[Royaume de Fer-Rouge]] avec la [[Issy|ville éponyme]] comme capitale.
-    ** [[Tortamor]] fonde [[Vicciopolis]] sur [[Nettai]].
-    ** [[Végétalia]] rejoint le [[Royaume de Fer-Rouge]].
-
-    === Tempopidum ===
-
-    * 1ᵉʳ tempopidum
-    ** La [[Panitropole]] reconnait la Ligue Gaiartois en tant qu'état.
-    ** Les villes d'[[Etherington]] et [[Alster]] fondent le [[Royaume d'Hussey]].
-    *2 tempopidum, [[XiloThor]] fonde [[Demacia]].
-    *3 tempopidum, [[Fer-Rouge]] organise les premières enchères depuis la [[Nouvelle Colonisation]] avec les boites mystères.
-    *6 tempopidum
-    **Le [[Fer-Rouge|Royaume de Fer-Rouge]] et d'[[Royaume d'Hussey|Hussey]] signent le [[Pacte des Enfants de Gehenna]].
-    **[[Absolon Enjouvar]] sous le nom de Snaurky infiltre et pille successivement les villes d'[[IndustrialTown]] et [[Brouswell]], ces pillages sont dénoncés a travers la communauté internationale.
-    *7 tempopidum
-    **Le [[Pacte des Enfants de Gehenna]] déclare [[Absolon Enjouvar]] hors-la-loi.
-    **[[Winly]] fonde [[Naxos]].
-    **[[Port-Angéis]] organise une fête pour inaugurer l'[[Hôtel de la ligue]] et l'[[Église de l'Ange-Pain]] et honorer le développement marchand de la ville et du reste du monde.
-    *8 tempopidum
-    **Le [[Royaume de Fer-Rouge]] annonce un ultimatum de 72h contre [[Issy]].
-    **En réponse a l'ultimatum du [[Royaume de Fer-Rouge]], les villes d'[[Issy]], [[Azuria]] et [[Kappi|X-ray]] signent un accord de défense nommé [[IXA]].
-    * 10 tempopidum, fin de la [[Nouvelle Colonisation]].
-    * 11 tempopidum
-    ** Le [[Pacte des Enfants de Gehenna]] déclare la guerre a [[Issy]] qui n'a pas répondu a l'ultimatum.
-    ** Début de la [[Guerre de Gehenna]].
-    *12 tempopidum
-    **L'armée du [[Pacte des Enfants de Gehenna]] s'attaque a [[Issy]] et est repoussée par l'[[IXA]].
-    **L'armée de l'[[IXA]] s'attaque a [[IndustrialTown]] et est repoussée par le [[Pacte des Enfants de Gehenna]].
-    *13 tempopidum, [[FrostBourne]] fait sécession avec le [[Royaume d'Hussey]] pour se retirer de la [[Guerre de Gehenna]] et fonde le [[Frostbourne|Royaume de Frostbourne]].
-    *15 tempopidum
-    **L'armée de l'[[IXA]] s'attaque a [[Naxos]] et capture la ville défendue par le [[Pacte des Enfants de Gehenna]].
-    **L'armée de l'[[IXA]] s'attaque a [[Alster]] et capture la ville défendue par le [[Pacte des Enfants de Gehenna]].
-    *16 tempopidum, [[Incident Rubéonais]].
-
-    === Quinésil ===
-
-    === Éposendre ===
-
-    * 15 éposendre, [[Kætern d'Ange]] trouve les objets volés par [[Absolon Enjouvar]] a [[Port-Angéis]].
-
-    [[Catégorie:Gaiartos-Histoire]]
-
-    ```
-    Les mois incomplets ou vides le sont pas manque d'historiens (c'est en partie ça cause de ça que tu vas devoirs faire ce job).
-
-    Voici maintenant en contexte les messages des 7 septs derniers jours. Ils ne sont là qu'en contexte, ne les résume pa,s mais tu peux t'en servir si besoin :
-    #annonces :
-    {messages_as_context_annonces}
-
-    #géopolitique : 
-    {messages_as_context_géopolitique}
-
-    Voici maintenant les messages que tu vas devoirs résumés pour le format de fandom. ATTENTION, dans le résumé, je ne veux que les choses qui devraient être sur le fandom, donc n'éhsite pas à ne pas utiliser les messages peu importants, ou si rien ne s'est passé dans une journée, répond 'NONE' :
-    #annonces :
-    {messages_to_summarize_annonces}
-
-    #géopolitique : 
-    {messages_to_summarize_géopolitique}.
-
-    Je veux que ta liste d'évènements soit sous le même format que le fandom, donc
-    * jour mois
-    **évènement1
-    **évènement2
-    **évènement ....
-
-    S'il n'y a qu'un seul évènement, alors formatte le :
-    * jour mois, évènement
-
-    et s'il n'y a rien eu d'intéressant/important alors formatte le :
-    * jour mois, NONE
-
-    Voilà au boulot, dans ta réponse donne seulement ta réponse formattée sans commentaires additionnels.
-    Je rappelle, ta réponse doit être en français, et résumer uniquement les jours à résumer, et pas ceux en contexte.
+# maximum number of tokens of context messages put in a prompt
+context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', '200000'))
+
+# input token limit of the model, the context is cut further if the prompt would not fit in it otherwise
+model_input_token_limit = int(os.getenv('MODEL_INPUT_TOKEN_LIMIT', '2000000'))
+
+# "compact" gives the messages with a header per channel and Gaiartian day, short time stamps, author aliases and the
+# consecutive messages of an author merged, "verbose" repeats the author and the full Gaiartian date on every message
+transcript_format = os.getenv('TRANSCRIPT_FORMAT', 'compact')
+
+# tokens taken by the author and date around the content of a formatted message
+message_header_tokens = 12 if transcript_format == 'verbose' else 4
+
+# consecutive messages of an author sent less than this many minutes apart are merged in the compact transcript
+transcript_merge_minutes = float(os.getenv('TRANSCRIPT_MERGE_MINUTES', '10'))
+
+wiki_entity_pattern = re.compile(r"\[\[([^\]|]+)(?:\|[^\]]*)?\]\]")
+proper_noun_pattern = re.compile(r"@?\b[A-ZÀ-ÖØ-Þ][\w'-]{2,}")
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of a text offline, pessimistically (French text is around 3.5 chars/token)."""
+    return math.ceil(len(text) / 3)
+
+
+def message_tokens(message):
+    """Estimate the number of tokens a message takes once formatted."""
+    return estimate_tokens(message.author_name) + estimate_tokens(message.content) + message_header_tokens
+
+
+def compact_transcript(messages_by_channel, formatted=None):
+    """Serialize messages as a compact transcript: a header per channel and per Gaiartian day, HH:MM stamps, aliases
+    for the names of the authors, and the consecutive messages of an author merged.
+
+    formatted caches the Gaiartian day and stamp of each message by id, and the aliases of the authors: the blocks
+    of a prompt built with the same cache give an author the same alias. Each block defines an alias the first time
+    it uses it, so it doesn't depend on the order the blocks are built in.
+    """
+    formatted = {} if formatted is None else formatted
+    aliases = formatted.setdefault('aliases', {})
+    defined = set()
+    merge_gap = timedelta(minutes=transcript_merge_minutes)
+    lines = []
+    for channel_name, messages in messages_by_channel.items():
+        lines.append(f"\n#{channel_name}")
+        current_day = None
+        previous = None
+        for message in messages:
+            if message.id not in formatted:
+                formatted[message.id] = (calculate_gaiartian_date(message.created_at),
+                                         message.created_at.strftime("%H:%M"))
+            day, stamp = formatted[message.id]
+            if day != current_day:
+                year, day_number, month = day
+                lines.append(f"== An {year}, {day_number} {month} ==")
+                current_day = day
+                previous = None
+
+            if (previous is not None and previous.author_name == message.author_name
+                    and message.created_at - previous.created_at <= merge_gap):
+                lines.append(message.content)
+            else:
+                author = message.author_name
+                if len(author) > 3:
+                    alias = aliases.setdefault(author, f"A{len(aliases) + 1}")
+                    author = alias if alias in defined else f"{alias}={author}"
+                    defined.add(alias)
+                lines.append(f"{stamp} {author}: {message.content}")
+            previous = message
+    return '\n'.join(lines)
+
+
+def extract_terms(message):
+    """Return the terms used to rank a message: its author, [[wiki entities]] and the names it contains."""
+    terms = [message.author_name.lower()]
+    terms += [entity.strip().lower() for entity in wiki_entity_pattern.findall(message.content)]
+    terms += [name.lstrip('@').lower() for name in proper_noun_pattern.findall(message.content)]
+    return terms
+
+
+def pack_context(context_by_channel, to_summarize_by_channel, token_budget, k1=1.5, b=0.75):
+    """Keep the context messages most relevant to the messages to summarize within a token budget.
+
+    Context messages are ranked with BM25 against the terms of the messages to summarize, ties (and unrelated
+    messages) going to the most recent ones. Returns the kept messages by channel, in their original order, and a
+    report of what was dropped.
+    """
+    query = {term for messages in to_summarize_by_channel.values() for m in messages for term in extract_terms(m)}
+    documents = [(channel_name, m, Counter(extract_terms(m)))
+                 for channel_name, messages in context_by_channel.items() for m in messages]
+    if not documents:
+        return context_by_channel, "Context packer: no context messages"
+
+    average_length = sum(sum(terms.values()) for _, _, terms in documents) / len(documents)
+    document_frequency = Counter(term for _, _, terms in documents for term in terms)
+    # only the terms of the query count, a document is scored from its own few terms rather than the whole query
+    idf = {term: math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+           for term, frequency in document_frequency.items() if term in query}
+
+    def score(terms):
+        length_norm = k1 * (1 - b + b * sum(terms.values()) / average_length)
+        return sum(idf[term] * frequency * (k1 + 1) / (frequency + length_norm)
+                   for term, frequency in terms.items() if term in idf)
+
+    ranked = sorted(documents, key=lambda document: (score(document[2]), document[1].id), reverse=True)
+
+    kept_ids = set()
+    kept_tokens = 0
+    dropped_tokens = 0
+    for channel_name, message, _ in ranked:
+        tokens = message_tokens(message)
+        if kept_tokens + tokens <= token_budget:
+            kept_ids.add((channel_name, message.id))
+            kept_tokens += tokens
+        else:
+            dropped_tokens += tokens
+
+    packed = {channel_name: [m for m in messages if (channel_name, m.id) in kept_ids]
+              for channel_name, messages in context_by_channel.items()}
+    report = (f"Context packer: kept {len(kept_ids)}/{len(documents)} messages (~{kept_tokens} tokens), "
+              f"dropped {len(documents) - len(kept_ids)} (~{dropped_tokens} tokens), budget {token_budget} tokens")
+    return packed, report
+
+
+class ArchivedMessage:
+    """Lightweight copy of a discord message, as stored in the local archive."""
+
+    # no per-instance dict, long histories hold tens of thousands of these
+    __slots__ = ('id', 'channel_id', 'created_at', 'author_name', 'content', 'author_bot')
+
+    def __init__(self, id, channel_id, created_at, author_name, content, author_bot=False):
+        self.id = id
+        self.channel_id = channel_id
+        self.created_at = created_at
+        # the same few authors write most messages, so they all share one string per name
+        self.author_name = sys.intern(author_name)
+        self.content = content
+        self.author_bot = author_bot
+
+
+class MessageArchive:
+    """Persistent archive of channel messages keyed by channel and message snowflake."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                author_name TEXT NOT NULL,
+                content TEXT NOT NULL,
+                author_bot INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (channel_id, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS channels (
+                channel_id INTEGER PRIMARY KEY,
+                covered_since REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fetch_checkpoints (
+                channel_id INTEGER PRIMARY KEY,
+                oldest_message_id INTEGER NOT NULL
+            );
+        """)
+        # archives created before the bot flag was stored, their messages count as written by humans
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(messages)")]
+        if 'author_bot' not in columns:
+            with self.connection:
+                self.connection.execute("ALTER TABLE messages ADD COLUMN author_bot INTEGER NOT NULL DEFAULT 0")
+
+    def get_coverage(self, channel_id):
+        """Return (covered_since, newest_message_id) for a channel, either being None if it was never fetched.
+
+        covered_since stays None while the first walk back in the history isn't over.
         """
-        print(system_message)
-        async with message.channel.typing():
+        row = self.connection.execute("SELECT covered_since FROM channels WHERE channel_id = ?",
+                                      (channel_id,)).fetchone()
+        newest_id = self.connection.execute("SELECT MAX(message_id) FROM messages WHERE channel_id = ?",
+                                            (channel_id,)).fetchone()[0]
+        return (datetime.fromtimestamp(row[0], timezone.utc) if row else None), newest_id
+
+    def set_covered_since(self, channel_id, covered_since):
+        """Record that every message of the channel since covered_since is in the archive."""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO channels (channel_id, covered_since) VALUES (?, ?)",
+                                    (channel_id, covered_since.timestamp()))
+            # the walk back in the history is over
+            self.connection.execute("DELETE FROM fetch_checkpoints WHERE channel_id = ?", (channel_id,))
+
+    def get_checkpoint(self, channel_id):
+        """Return the oldest message id reached by an interrupted walk back in the channel history, or None."""
+        row = self.connection.execute("SELECT oldest_message_id FROM fetch_checkpoints WHERE channel_id = ?",
+                                      (channel_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, channel_id, oldest_message_id):
+        """Record how far back the walk in the channel history went. Every message from there to the newest archived
+        one is in the archive."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fetch_checkpoints (channel_id, oldest_message_id) VALUES (?, ?)",
+                (channel_id, oldest_message_id))
+
+    def store_messages(self, records):
+        """Insert or refresh a batch of archived messages."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO messages "
+                "(channel_id, message_id, created_at, author_name, content, author_bot) VALUES (?, ?, ?, ?, ?, ?)",
+                [(r.channel_id, r.id, r.created_at.timestamp(), r.author_name, r.content, r.author_bot)
+                 for r in records])
+
+    def update_content(self, channel_id, message_id, content):
+        """Update the content of an already archived message (no-op if it isn't archived)."""
+        with self.connection:
+            self.connection.execute("UPDATE messages SET content = ? WHERE channel_id = ? AND message_id = ?",
+                                    (content, channel_id, message_id))
+
+    def delete_message(self, channel_id, message_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM messages WHERE channel_id = ? AND message_id = ?",
+                                    (channel_id, message_id))
+
+    def get_messages_between(self, channel_id, after_id, before_id):
+        """Return the archived messages of a channel with an id between after_id and before_id, from oldest to
+        newest."""
+        rows = self.connection.execute(
+            "SELECT message_id, created_at, author_name, content, author_bot FROM messages "
+            "WHERE channel_id = ? AND message_id > ? AND message_id < ? ORDER BY message_id",
+            (channel_id, after_id, before_id))
+        return [ArchivedMessage(message_id, channel_id, datetime.fromtimestamp(created_at, timezone.utc),
+                                author_name, content, bool(author_bot))
+                for message_id, created_at, author_name, content, author_bot in rows]
+
+
+message_archive = MessageArchive(archive_path)
+
+# noise filter rules applied to the messages before they are formatted, separated by commas:
+# bot (messages from bots), empty (messages without any letter or digit, like emoji-only ones), ooc (messages entirely
+# between parentheses), short (messages of less than noise_min_words words) and crosspost (messages posted again in
+# another channel)
+noise_filters = [rule.strip() for rule in os.getenv('NOISE_FILTERS', 'bot,empty,ooc,short,crosspost').split(',')
+                 if rule.strip()]
+
+# messages with less words than this are dropped by the short rule
+noise_min_words = int(os.getenv('NOISE_MIN_WORDS', '2'))
+
+custom_emoji_pattern = re.compile(r"<a?:\w+:\d+>")
+ooc_pattern = re.compile(r"^\s*\(.*\)\s*$", re.DOTALL)
+
+
+def noise_rule(message):
+    """Return the name of the first enabled rule catching a message, or None if it's kept. crosspost isn't checked."""
+    if 'bot' in noise_filters and message.author_bot:
+        return 'bot'
+    if 'empty' in noise_filters and not any(char.isalnum()
+                                            for char in custom_emoji_pattern.sub('', message.content)):
+        return 'empty'
+    if 'ooc' in noise_filters and ooc_pattern.match(message.content):
+        return 'ooc'
+    if 'short' in noise_filters and len(message.content.split()) < noise_min_words:
+        return 'short'
+    return None
+
+
+def normalize_content(content):
+    """Return a hash of a message content ignoring case, spacing and punctuation, to recognize cross-posts."""
+    normalized = ' '.join(''.join(char if char.isalnum() else ' ' for char in content.lower()).split())
+    return hashlib.sha1(normalized.encode()).digest()
+
+
+def filter_noise(messages_by_channel, removed):
+    """Return messages_by_channel without the messages caught by the noise filter rules.
+
+    removed counts the messages and estimated tokens each rule removed, as {rule: Counter(messages, tokens)}.
+    """
+    filtered = {}
+    for channel_name, messages in messages_by_channel.items():
+        filtered[channel_name] = []
+        for message in messages:
+            rule = noise_rule(message)
+            if rule is None:
+                filtered[channel_name].append(message)
+            else:
+                removed[rule].update(messages=1, tokens=message_tokens(message))
+
+    if 'crosspost' in noise_filters:
+        # the channel of the first copy of each content, copies in other channels are dropped
+        hashes = {message.id: normalize_content(message.content)
+                  for messages in filtered.values() for message in messages}
+        first_copies = {}
+        for channel_name, messages in filtered.items():
+            for message in messages:
+                first_copy = first_copies.get(hashes[message.id])
+                if first_copy is None or message.id < first_copy[1]:
+                    first_copies[hashes[message.id]] = (channel_name, message.id)
+        for channel_name, messages in filtered.items():
+            kept = []
+            for message in messages:
+                if first_copies[hashes[message.id]][0] != channel_name:
+                    removed['crosspost'].update(messages=1, tokens=message_tokens(message))
+                else:
+                    kept.append(message)
+            filtered[channel_name] = kept
+    return filtered
+
+
+def noise_report(removed):
+    """Describe what each noise filter rule removed."""
+    if not removed:
+        return "Noise filter: nothing removed"
+    return "Noise filter: " + ', '.join(f"{rule} {counts['messages']} messages (~{counts['tokens']} tokens)"
+                                        for rule, counts in removed.items())
+
+
+# day summaries unused for longer than this many days are evicted from the cache
+day_cache_max_age_days = float(os.getenv('DAY_CACHE_MAX_AGE_DAYS', '60'))
+
+# maximum number of day summaries kept in the cache, the least recently used ones are evicted first
+day_cache_max_entries = int(os.getenv('DAY_CACHE_MAX_ENTRIES', '2000'))
+
+
+class DaySummaryCache:
+    """Persistent cache of the map-reduce day summaries, keyed by channel set, Gaiartian day and content hash."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS day_summaries (
+                channel_set TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (channel_set, year, month, day)
+            );
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_messages(messages_by_channel):
+        """Hash the raw messages of a day. The prompt isn't hashed, the author aliases in it depend on the window."""
+        content_hash = hashlib.sha256()
+        for channel_name, messages in messages_by_channel.items():
+            for message in messages:
+                content_hash.update(repr((channel_name, message.id, message.author_name, message.content)).encode())
+        return content_hash.hexdigest()
+
+    def get(self, channel_set, day, content_hash):
+        """Return the cached summary of a day, or None if the day is unknown or its messages changed since."""
+        year, day_number, month = day
+        row = self.connection.execute(
+            "SELECT summary FROM day_summaries WHERE channel_set = ? AND year = ? AND month = ? AND day = ? "
+            "AND content_hash = ?", (channel_set, year, month, day_number, content_hash)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.connection:
+            self.connection.execute(
+                "UPDATE day_summaries SET last_used = ? WHERE channel_set = ? AND year = ? AND month = ? AND day = ?",
+                (datetime.now(timezone.utc).timestamp(), channel_set, year, month, day_number))
+        return row[0]
+
+    def put(self, channel_set, day, content_hash, summary):
+        """Store the summary of a day, replacing the one made from an older version of its messages."""
+        year, day_number, month = day
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO day_summaries (channel_set, year, month, day, content_hash, summary, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (channel_set, year, month, day_number, content_hash, summary, datetime.now(timezone.utc).timestamp()))
+
+    def evict(self):
+        """Remove the summaries unused for too long, then the least recently used ones above the size limit."""
+        max_age_threshold = datetime.now(timezone.utc) - timedelta(days=day_cache_max_age_days)
+        with self.connection:
+            self.connection.execute("DELETE FROM day_summaries WHERE last_used < ?", (max_age_threshold.timestamp(),))
+            self.connection.execute(
+                "DELETE FROM day_summaries WHERE rowid NOT IN "
+                "(SELECT rowid FROM day_summaries ORDER BY last_used DESC LIMIT ?)", (day_cache_max_entries,))
+
+    def report(self):
+        """Return the hit/miss counts since the last report and reset them."""
+        total = self.hits + self.misses
+        report = f"Day summary cache: {self.hits}/{total} hits, {self.misses} misses"
+        self.hits = 0
+        self.misses = 0
+        return report
+
+
+day_summary_cache = DaySummaryCache(archive_path)
+
+# number of hours between two scheduled digests of the new messages, 0 disables them
+digest_interval_hours = float(os.getenv('DIGEST_INTERVAL_HOURS', '0'))
+
+
+class DigestLog:
+    """Persistent log of the scheduled digests, each one summarizing the messages posted since the previous one."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS digests (
+                ran_at REAL PRIMARY KEY,
+                year INTEGER NOT NULL,
+                summary TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS digests_by_year ON digests (year, ran_at);
+        """)
+
+    def get_last_run(self):
+        """Return when the last digest ran, or None if there never was one."""
+        row = self.connection.execute("SELECT MAX(ran_at) FROM digests").fetchone()
+        return datetime.fromtimestamp(row[0], timezone.utc) if row[0] is not None else None
+
+    def append(self, ran_at, year, summary):
+        """Record a digest in the log of a Gaiartian year. Empty summaries are recorded too, they mark the run."""
+        with self.connection:
+            self.connection.execute("INSERT INTO digests (ran_at, year, summary) VALUES (?, ?, ?)",
+                                    (ran_at.timestamp(), year, summary))
+
+    def get_year(self, year):
+        """Return the digests of a Gaiartian year put back together, from oldest to newest."""
+        rows = self.connection.execute("SELECT summary FROM digests WHERE year = ? AND summary != '' ORDER BY ran_at",
+                                       (year,))
+        return '\n'.join(summary for summary, in rows)
+
+
+digest_log = DigestLog(archive_path)
+
+
+class FailedPrompts:
+    """Prompts whose generation failed, kept so they can be generated again without fetching the messages again."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS failed_prompts (
+                failed_at REAL PRIMARY KEY,
+                command TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                model TEXT,
+                system_instruction TEXT,
+                user_input TEXT NOT NULL
+            );
+        """)
+
+    def save(self, command, filename, model, prompt):
+        system_instruction, user_input = prompt
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO failed_prompts (failed_at, command, filename, model, system_instruction, "
+                "user_input) VALUES (?, ?, ?, ?, ?, ?)",
+                (datetime.now(timezone.utc).timestamp(), command, filename, model, system_instruction, user_input))
+
+    def get_last(self):
+        """Return (failed_at, command, filename, model, prompt) of the last failed prompt, or None if there is none."""
+        row = self.connection.execute(
+            "SELECT failed_at, command, filename, model, system_instruction, user_input FROM failed_prompts "
+            "ORDER BY failed_at DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        failed_at, command, filename, model, system_instruction, user_input = row
+        return failed_at, command, filename, model, (system_instruction, user_input)
+
+    def delete(self, failed_at):
+        with self.connection:
+            self.connection.execute("DELETE FROM failed_prompts WHERE failed_at = ?", (failed_at,))
+
+
+failed_prompts = FailedPrompts(archive_path)
+
+
+# "* 16 gaiarkhè" or "* 6 gaiarkhè, event", and "** event" lines of the fandom format
+fandom_day_pattern = re.compile(r"^\*\s*(\d+)\s*(?:ᵉʳ|er)?\s+(\w+)\s*(?:,\s*(.*))?$")
+fandom_event_pattern = re.compile(r"^\*\*\s*(.+)$")
+
+
+def parse_fandom_events(text, reference):
+    """Parse the events of a response in the fandom format into (year, month index, day, event) tuples.
+
+    Responses only give days and months, the year is the one of the reference date, or the previous one for months
+    after the reference month. Days with NONE and lines that don't follow the format are skipped.
+    """
+    reference_year, _, reference_month = calculate_gaiartian_date(reference)
+    month_indexes = {month.lower(): index for index, month in enumerate(months)}
+    events = []
+    day = None
+    for line in text.splitlines():
+        line = line.strip()
+        event_match = fandom_event_pattern.match(line)
+        if event_match:
+            if day is not None:
+                events.append((*day, event_match.group(1).strip()))
+            continue
+        day_match = fandom_day_pattern.match(line)
+        month_index = month_indexes.get(day_match.group(2).lower()) if day_match else None
+        if month_index is None:
+            day = None
+            continue
+        year = reference_year
+        if month_index > months.index(reference_month):
+            # There is no year 0 in the Gaiartian calendar
+            year = year - 1 or -1
+        day = (year, month_index, int(day_match.group(1)))
+        event = (day_match.group(3) or '').strip()
+        if event and event != 'NONE':
+            events.append((*day, event))
+    return events
+
+
+class EventStore:
+    """Persistent store of the events summarized so far, indexed by Gaiartian date and by linked wiki entity."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                event_id INTEGER PRIMARY KEY,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (year, month, day, text)
+            );
+            CREATE TABLE IF NOT EXISTS event_entities (
+                event_id INTEGER NOT NULL,
+                entity TEXT NOT NULL,
+                PRIMARY KEY (entity, event_id)
+            );
+        """)
+
+    def add_events(self, events, replace_since=None):
+        """Store (year, month index, day, event) tuples, ignoring the ones already stored.
+
+        replace_since is the start of the window the events were summarized from. The events stored for the days
+        starting inside it are removed first, so a new summary of a day replaces the previous one instead of adding
+        its rewordings to it. The first day of the window is only partly in it, its events are added to the stored
+        ones. Returns how many events were new.
+        """
+        replaced_days = self.days_starting_since(events, replace_since) if replace_since else set()
+        added = 0
+        with self.connection:
+            for year, month, day in replaced_days:
+                self.connection.execute(
+                    "DELETE FROM event_entities WHERE event_id IN "
+                    "(SELECT event_id FROM events WHERE year = ? AND month = ? AND day = ?)", (year, month, day))
+                self.connection.execute("DELETE FROM events WHERE year = ? AND month = ? AND day = ?",
+                                        (year, month, day))
+            for year, month, day, text in events:
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO events (year, month, day, text) VALUES (?, ?, ?, ?)",
+                    (year, month, day, text))
+                if cursor.rowcount == 0:
+                    continue
+                added += 1
+                # links to files and categories are not entities
+                entities = {entity.strip().lstrip(':') for entity in wiki_entity_pattern.findall(text)}
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO event_entities (event_id, entity) VALUES (?, ?)",
+                    [(cursor.lastrowid, entity) for entity in entities if ':' not in entity])
+        return added
+
+    @staticmethod
+    def days_starting_since(events, since):
+        """Return the (year, month index, day) of the events whose day starts at or after since."""
+        days = set()
+        for year, month, day in {event[:3] for event in events}:
             try:
-                response = generate_response("Procède.", system_message)
-                print(response)
-                if len(response) > 2000:
-                    # send multiple messages in a row instead
-                    for i in range(0, len(response), 2000):
-                        await message.channel.send(response[i:i + 2000])
+                start, _ = gaiartian_day_to_utc_range(year, months[month], day)
+            except ValueError:
+                # a day the calendar doesn't have, nothing stored can be replaced
+                continue
+            if start >= since:
+                days.add((year, month, day))
+        return days
+
+    def get_year(self, year):
+        """Return the events of a Gaiartian year as (month index, day, event), in chronological order."""
+        return self.connection.execute(
+            "SELECT month, day, text FROM events WHERE year = ? ORDER BY month, day, event_id", (year,)).fetchall()
+
+    def get_entity_events(self, entity):
+        """Return the events linking to a wiki entity as (year, month index, day, event), in chronological order."""
+        return self.connection.execute(
+            "SELECT year, month, day, text FROM events JOIN event_entities USING (event_id) WHERE entity = ? "
+            "ORDER BY year, month, day, event_id", (entity,)).fetchall()
+
+    def build_year_page(self, year):
+        """Return the events section of the 'An X' fandom page of a Gaiartian year, in wikicode."""
+        events_by_day = defaultdict(list)
+        for month, day, text in self.get_year(year):
+            events_by_day[month, day].append(text)
+
+        lines = ["==Événements=="]
+        for month_index, month in enumerate(months):
+            lines += [f"==={month}===", ""]
+            month_days = [(day, events) for (event_month, day), events in events_by_day.items()
+                          if event_month == month_index]
+            for day, events in month_days:
+                day_str = f"{'1ᵉʳ' if day == 1 else day} {month.lower()}"
+                if len(events) == 1:
+                    lines.append(f"* {day_str}, {events[0]}")
                 else:
-                    await message.channel.send(response)
-            except Exception as e:
-                await message.channel.send(f"Error: {e}")
+                    lines.append(f"* {day_str}")
+                    lines += [f"** {event}" for event in events]
+            if month_days:
+                lines.append("")
+        lines.append("[[Catégorie:Gaiartos-Histoire]]")
+        return '\n'.join(lines)
 
-    async def journal(self, message):
-        # Define the list of channel IDs to process
-        channel_ids = [718824042685136936, 1017475737852317768]  # Add your channel IDs here
 
-        # Initialize dictionaries to store messages by channel name
-        all_messages_to_summarize = {}
-        all_messages_as_context = {}
+event_store = EventStore(archive_path)
 
-        # For each channel
-        for channel_id in channel_ids:
-            # Fetch raw messages
-            messages = await self.get_messages_since_last_x_hours(channel_id, context_hours)
-            # Split messages into those to summarize and context messages
-            messages_to_summarize, messages_as_context = await split_messages_by_hours(messages, hours_to_summarize)
-            # Format messages after splitting
-            messages_to_summarize_formatted = [await self.format_message(m) for m in messages_to_summarize]
-            messages_as_context_formatted = [await self.format_message(m) for m in messages_as_context]
 
-            # Get the channel name
-            channel = self.get_channel(channel_id)
-            channel_name = channel.name if channel else f"Channel {channel_id}"
+# "single" sends the whole window in one prompt, "map_reduce" summarizes each Gaiartian day separately then merges them
+summary_mode = os.getenv('SUMMARY_MODE', 'single')
 
-            # Store the formatted messages in the dictionaries
-            all_messages_to_summarize[channel_name] = messages_to_summarize_formatted
-            all_messages_as_context[channel_name] = messages_as_context_formatted
-
-        # Build the context messages string
-        context_messages_str = ''
-        for channel_name, messages in all_messages_as_context.items():
-            context_messages_str += f"\n#{channel_name} :\n"
-            context_messages_str += '\n'.join(messages)
-
-        # Build the messages to summarize string
-        messages_to_summarize_str = ''
-        for channel_name, messages in all_messages_to_summarize.items():
-            messages_to_summarize_str += f"\n#{channel_name} :\n"
-            messages_to_summarize_str += '\n'.join(messages)
-        system_message = f"""Tu seras un Agent dont le but est de résumé des évènements de salons RPs d'un salon discord dans un format tel que les résumés puissent être automatiquement ajoutés à une page fandom. Le serveur discord est le serveur discord d'un serveur minecraft nommé LaBoulangerie qui est un serveur géopolitique semi-rp. Tu résumeras le contenu du salon #géopolitique qui est le salon pour rp et faire de la géopolitique, mais tu résumeras aussi le salon #annonces qui est le salon des annocnes rp et géopolitiques, des villes, nations, entreprises, roganisations, joueurs etc... Tu seras donné la liste des messages des {hours_to_summarize} dernières heures à résumés. Chaque message aura son auteur, sa date, et son contenu textuel. Tu seras aussi donné en contexte, les messages des 7 précédents jours, mais eux ne seront pas à résumés, résume seulement ceux des {hours_to_summarize} (qui te seront donnés séparemment."
-Le format d'un message sera 'author_name [date]: message_content' with [date] being in the format [An X, le DAY_NUMBER de CUSTOM_MONTH_NAME à TIME_IN_HOURS_MINUTES_SECONDS] parce que oui Gairtos utilise seulement 4 mois customs : Gaiarkhè, Tempopidum, Quinésil, Éposendre
-Dans le Fandom, chaque An a sa propre page, et dedans à un moment il y a les évènements dans un ordre chronologique. Je vais te donner comme example le wikicode de la page de l'An 4 , regarde bien comment il est formatté. Tu devras seulement créer des tirets pour des évèhnements à des dates. Tu devras faire un tiret (et donc résumé) par jour donné, voici le wikicode complet de la page :
-L''''an 4''' est une année tertiaire du Calendrier Gaiartois qui commence un vendredi. Elle fait suite à l'[[an 3]] et précède l'[[an 5]].
-
-Elle correspond à l'an 2003 du [[Calendrier Panimorphe]] et les mois de septembre à décembre 2023 du [[Calendrier Minecraftien]].
-```
-==Événements==
-===Gaiarkhè===
-
-* 6 gaiarkhè, [[Kætern d'Ange]] fonde [[Dolivageä]].
-* 9 gaiarkhè, [[Dolivageä]] adopte la [[:Fichier:Bannière de Dolivageä.png|Bannière de Dolivageä]].
-* 10 gaiarkhè, [[Algard]] cède une partie de ses terres du nord à [[Dolivageä]] suite à un entretien entre [[Valgard Arkisson|Valgard Arkinsson]] et [[Kætern d'Ange]].
-* 16 gaiarkhè
-** [[Dolivageä]] adopte le [[:Fichier:Blason de Dolivageä.png|Blason de Dolivageä]].
-** [[Dolivageä]] inaugure le [[Temple du Rubis]] et annonce sa participation au [[concours de patrimoine]] de la [[Panitropole]].
-* 17 gaiarkhè
-** [[Red 1er|Red Ier]] et [[Kætern d'Ange]] signent le [[Traité de Dolivageä]].
-** [[Kætern d'Ange]] fonde le [[Duché de Dolivageä]] qui adopte la [[:Fichier:Bannière de Dolivageä.png|Bannière]] et le [[:Fichier:Blason de Dolivageä.png|Blason de Dolivageä]].
-*21 gaiarkhè, le [[Duché de Dolivageä]] et sa [[Dolivageä|préfecture]] adoptent leur devise officielle « [[Nos louanges se chantent en Arthos]] ».
-* 28 gaiarkhè, [[Dolivageä]] et [[Cushy]] inaugurent [[le Prismarin]].
-
-===Tempopidum===
-
-* 1ᵉʳ tempopidum
-** [[PainOraisins]] décode l'énigme de [[Fryzhen]].
-** [[Léonard Vizzini]] meurt dans un attentat commis, selon [[Goldcrest]], par des militants [[Familisme|familistes]].
-** [[Adrian Hartmann]] publie l'essai [[Réflexion sur l'Illusion du Bien Commun]].
-** Le [[Nalvarune|Royaume de Nalvarune]] adopte un régime oligarchique, [[Sir Matthew Percival Norrington|Matthew Norrington]], [[François LeNoble]] et [[Valérian "Caesar" Nerona|Valérian Nerona]] sont nommés [[Oligarque de Nalvarune|oligarques de Nalvarune]].
-*3 tempopidum
-**Le [[Petit Gaiartois]] publie le dixième numéro de [[Petit Gaiartois (journal)|son hebdomadaire]].
-**[[Zagrivocha]] répond à l'annonce de l'assassinat de [[Léonard Vizzini]] en la remettant en cause et en condamnant l'attentat, et dénonce le traitement de l'affaire par le [[Petit Gaiartois]].
-*5 tempopidum
-**Le [[Petit Gaiartois]] répond à la réponse de [[Zagrivocha]] en la traitant comme une menace, annonce une édition spéciale sur les [[attentats des routes du Nether]] et lance un sondage sur l'augmentation du prix de [[Petit Gaiartois (journal)|son hebdomadaire]].
-**[[Zagrivocha]] répond de nouveau au [[Petit Gaiartois]] en expliquant ne pas la menacer.
-* 10 tempopidum, le [[Petit Gaiartois]] publie le onzième numéro de [[Petit Gaiartois (journal)|son hebdomadaire]].
-* 11 tempopidum
-** [[Marc Lèone]] fonde l'[[Île-Croissant Souveraine]] sur l'[[Île-Croissant|île éponyme]] ou s'installe la [[Congrégation de la Chape|Congrégation de la Chappe]] après avoir pillé une partie des ressources d'[[Annales d'Augolia|Augolia]].
-** Le [[Parti Kæterniste]], dans le cadre de son combat contre le [[familisme]], publie l'[[affiche anti-familiste]] qu'elle fait mettre en vente à l'aide de la [[Fondation d'Ange]]. Il annonce travailler sur une proposition de premier [[Code Pénal du Royaume de Goast]], où serait interdit la « propagation des idées familistes ».
-*12 tempopidum
-**[[Kætern d'Ange]] lance le premier appel d'offre pour le chantier du [[Château de Dolivageä]].
-**[[Ludovicus Ventor]] érige la route entre [[Cushy]] et [[Nalvarune]].
-**[[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] fonde le [[Parti Capitaliste Gaiartois]].
-**[[Giga Zeus]] rend publique son usine à trident.
-*13 tempopidum
-**[[MMMOK]] pille [[Osharia]] puis rejoint [[Nalvarune]].
-**[[Nalvarune]] adopte la [[Constitution de Nalvarune]].
-**[[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] annonce les avancées de l'enquête sur l'[[Assassinat de Léonard Vizzini]], les auteurs du meurtre semblent décédés et d'origines [[Annales d'Augolia|augoloises]].
-*14 tempopidum
-**[[MMMOK]] pille [[Nalvarune]] avant de se faire tuer par [[Lengevin]].
-**[[Friolon|Friolon d'Orion]] organise la [[Congrégation des Marchands de Damield]] a [[Osterces]].
-*15 tempopidum
-**[[Kætern d'Ange]] trouve le cadavre de [[Tortamor]] et les [[journaux de Maximus]] après l'annonce de [[Cushy]]. Il y rencontre [[Maximus Maledictio]] et s'engage dans un combat avec, il finira par fuir avec les journaux en voyant la puissance de Maximus.
-**[[Maximus Maledictio]] attaque les [[routes du Nether]] avec une armée de withers, il y rencontre [[Louis-Philippe Vizzini|Louis-Philippe Vizzini Iᵉʳ]] qu'il tue lors d'un combat.
-**Un inconnu rase la fontaine du [[Cushy|quartier pauvre de Cushy]] lors d'une réunion au [[Panitropole|forum de la Panitropole]].
-**[[Endafyr Quamat]] annonce le repos de [[Kætern d'Ange]] à [[Cushy]] suite à une blessure subie lors de son combat contre [[Maximus Maledictio]].
-*16 tempopidum
-**[[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II]] devient maire de [[Goldcrest]].
-**Le [[Nalvarune|Royaume de Nalvarune]] modifie sa constitution pour y ajouter l'article concernant la Chancelière.
-**[[Gabrielle de Marliave]] est nommée Chancelière du [[Nalvarune|Royaume de Nalvarune]] par les Oligarques.
-**Le [[Nalvarune|Royaume de Nalvarune]] met en place sa vigilance attentat suite à l'[[attaque de Maximus Malédictio]].
-*18 tempopidum, [[Maximus Maledictio|Maximus Malédictio]] fait quelques apparitions à [[Zagrivocha]] et [[Nalvarune]].
-*20 tempopidum
-**[[Adrian Hartmann]] annonce chercher un emplacement pour l'[[Université de Clover]].
-**La [[Fondation d'Ange]] met en place le Fond Solimiste.
-*23 tempopidum
-**Osterces inaugure la Bibliothèque de la Congrégation de la Chape.
-**[[Maximus Maledictio]] fait une apparition à [[Annales d'Augolia|Augolia]].
-*24 tempopidum, le [[Petit Gaiartois]] publie le douzième numéro de [[Petit Gaiartois (journal)|son bihebdomadaire]].
-*25 tempopidum
-**Le [[Duché de Dolivageä]] inaugure le [[Pont Louis-Philippe Ier]] et la route entre [[Dolivageä]] et les [[ruines d'Asgardia]].
-**[[Nalvarune]] entame des fouilles archéologiques à son lac.
-**[[Valgard Arkisson|Valgard Arkinsson]] expose ses deux premières gravures a [[Algard]].
-*27 tempopidum, [[Louis-Philippe Vizzini II]] fonde la [[Vizzini Print]].
-*30 tempopidum [[Maximus Maledictio]] fait une apparition à [[Hernebhes des Solimes|Solimé]], par la suite, il tue [[Matzepol]], le meurtre est dénoncé par [[Nalvarune]] dans la foulée.
-*31 tempopidum, [[Cushy]] met la tête de [[Maximus Maledictio]] à prix.
-===Quinésil===
-
-* 1er quinésil, [[Osterces]] inaugure la [[Tour d'Yggdrasil]].
-* 2 quinésil, [[Osterces]] inaugure le [[café de l'Antique]].
-* 3 quinésil, [[Osterces]] inaugure la route la reliant aux [[ruines d'Asgardia]].
-* 4 quinésil
-** [[Revax]] fonde le parti des [[Partageurs Gaiartois Unis]] et distribue des tracs exposant son programme et annonçant vouloir détruire les symboles du [[Royaume de Goast]] dont les routes, ce tract provoque une polémique au sein du Royaume.
-** [[Dolivageä]] proclame hors-la-loi [[Revax]] et [[le Vagabond]] pour leur proximité avec l'idéologie [[Familisme|familiste]].
-** La résidence [[Le Vagabond|du Vagabond]] a [[Solimé]] est perquisitionnée par les autorités goasts.
-** [[Bidouille Dierne]] fonde la [[Bidouille Building Company]].
-** La [[Société Vizzini]] organise une soirée d'inauguration pour son restaurant le [[Vizzini d'Or]].
-** Le [[Nalvarune|Royaume de Nalvarune]] annonce avoir décodé les messages de [[Maximus Maledictio]].
-** La résidence de [[Revax]] a [[Solimé]] est perquisitionnée par les autorités goasts.
-*6 quinésil - [[Le Renard]] mène un coup d'état dans [[la retraite du Démon]] qu'il réussi et assassine [[Bleu Azure]].
-
-===Éposendre===
-```
-
-Je le répète, toi devras juste ajouté des dates individuelles, et si besoin les évènements individuels. Car un résumé d'un jour peut avoir plusieurs choses (c'est même probable).
-Le type d'évènement doit être un minimum important, comme tu le vois ici.
-Voici d'autres examples de pages d'An pour que tu comprennes quels types d'évènements sont gardés :
-```
-L''''an 5''' est une année tertiaire du [[Calendrier Gaiartois]] qui commence un vendredi. Elle fait suite à l'[[an 4]] et précède l'[[an 6]].
-
-Elle correspond à l'an 2004 du [[Calendrier Panimorphe]] et les mois de janvier à avril 2024 du [[Calendrier Minecraftien]].
-==Événements==
-===Gaiarkhè===
-
-* 2 gaiarkè, le [[Shade]] annonce la tenue du duel entre lui-même et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]].
-*6 gaiarkhè
-**[[Royaume de Goast|Goast]] rend son indépendance à [[Veltea]].
-**[[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] bat le [[Shade]] en duel dans le cadre du [[Shade#Légende du Cristal (Depuis le 22 éposendre de l'an 4)|Défi du Shade]].
-*7 gaiarkhè
-**[[Veltea]] s'effondre et [[Algard]] en prend le contrôle créant une polémique.
-**[[Végétalia]] s'effondre.
-*8 gaiarkhè, [[Algard]] cède le contrôle de [[Veltea]].
-*9 gaiarkhè
-**[[Alster]] prend le contrôle de [[Veltea]].
-**[[Kætern d'Ange]] annonce la tenue d'enchères au [[Château de Dolivageä]].
-
-*14 gaiarkhè, création de la Fédération Familiste de Brulfroï après un rapprochement entre les deux pays de Kappi et de Zagrivocha.
-*20 gaiarkhè
-**Enchères à [[Dolivageä|Dolivagëa]]. Le [[royaume de Goast]] accuse [[Royaume de Nalvarune|Nalvarune]] d'avoir menti sur la rareté des dromadaires vendus ainsi que [[Vindicta]] d'avoir manipulé les prix en surenchérissant les lots<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1198681122247286804|Annonce officielle du 21 janvier]]</ref>.
-**[[Ormick Ier|Ormick I<sup>er</sup>]] prend le trône vacant à [[Vicciopolis]] et dans la [[coprincipauté d'Hybloniopolis]], confirmant l'union personnelle entre les deux cité-États.
-
-* 24 gaiarkhè, érection d'une première Grande Tour Magique de Gaiartos, l'Aegeria, à Osterces.
-
-*26 gaiarkhè, inauguration de la bibliothèque à [[Cushy]].
-
-===Tempopidum===
-
-*3 tempopidum, [[Jorvik]] (aujourd'hui Poséage) rejoint le [[royaume de Goast]] pour la commémoration des 1 an de la fin de la [[Guerre des Quatre Armées]] dans le musée de [[Tharass]].
-*11 gaiarkhè
-**Début de la publication posthume de l'œuvre ''De la démocratie en Gaiartos'' de [[Mazer O’Shaw|Mazer O'Shaw]].
-**Friolon II prend la relève après que le précédent souverain d'[[Osterces]] ait été tué dans des « circonstances douteuses »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1206304677335924776|Annonce de la ville d'Osterces]] du même jour :« C'est depuis Osterces, que je vous parle : moi, Friolon deuxième du nom, prend la relève de la direction de la ville. En effet, notre précédent souverain et fondateur est décédé en de douteuses circonstances.  » </ref>.
-
-*12 gaiarkhè, le [[Azurentos|duché d'Azurentos]] déclare son indépendance du [[royaume de Nalvarune]], créant le [[royaume d'Astréa]], qui provoque une crise interne à Nalvarune.
-*17 gaiarkhè, organisation du concours quadriennal de course des bateaux de glace dans la [[Fédération Familiste de Bulfroi|F.F.B.]]
-*21 gaiarkhè, pousse de l'« Arbre de vie » à Algard sur lequel le Jarl a étendu sa résidence afin d'en apprendre davantage<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1209967995649007656|Annonce de la ville d'Algard]] du même jour</ref>.
-*23 tempopidum, mariage entre [[Ormick Ier|Ormick I<sup>er</sup>]] et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] à [[Vicciopolis]].
-*21 tempopidum, ouverture des candidatures pour l'élection des Grands Jurés du Comité des Brasseurs afin de revitaliser l'organisation<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1210219857090576437|Annonce du Comité]] le jour même</ref>.
-*25 tempodidum, fondation du [[royaume de Crusentia]] avec le maire d'[[Osharia]], les titulaires des trônes d'[[Coprincipauté d'Hybloniopolis|Hybloniopolis]] et de [[Vicciopolis]] et le maire de la cité-État de [[Cushy]].
-*25 tempopidum, naissance des enfants de [[Ormick Ier|Ormick I<sup>er</sup>]] et [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]] : Louis-Philippe Vizzini O'Shaw I<sup>er</sup> ''Junior'' et Emarant Vizzini O'Shaw I<sup>er</sup> ''Junior''
-*28 tempopidum
-**Aésultats des élections au [[Comité des Brasseurs]] : [[Nicolas Junlase]], [[Ruki tamashi|Ruki Tamashi]] et [[Ormick Ier|Ormick I<sup>er</sup>]] deviennent Grands Jurés.
-**Abdication du [[Guillaume Verentti Garois|Guillaume Garois I<sup>er</sup>]] en faveur de son fils [[Gaëtan Guillaume Garois|Gaëtan Garois II]] qui monte sur le trône à [[Astréa]].
-
-===Quinésil===
-
-*2 quinésil, nouvelles attaques sur les routes nétheresques.
-*3 quinésil
-**Mort de [[Nicolas Junlase]].
-**Disparition de ReNouy, voleur connu.
-
-*4 quinésil, 
-**Azurentos commercialise de la vodka black et du vin lumineux, vente condamnée par le Comité des Brasseurs qui fait proposer la guerre contre Azurentos au Conseil Constitutionnel de Goast.<ref>https://discord.com/channels/516302751500599316/718824042685136936/1214185513477480468</ref>
-**Création [[Rassemblement des Saveurs Brassicole]] par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]] en réponse à « [l'impossibilité] d'exploiter [ces] boisson[s] à moins d'en être le breveté »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1214009565323198484|Annonce officielle de l'organisation]]</ref>.
-*6 quinésil, création de la [[guilde des Marchands]] par [[Louis-Philippe Vizzini 2ème|Louis-Philippe Vizzini II<sup>ème</sup>]].
-*13 quinésil, annonce d'une collaboration entre le [[royaume de Goast]] et la [[Fédération Familiste de Bulfroi|F.F.B.]] pour la surveillance de l'exploitation des glaciers du nord, ainsi qu'une collaboration entre ce même royaume et la [[principauté d'Augolia]] pour revégétaliser et protéger l’environnement des [[Iles-de-Fer]].
-*17 quinésil, tenue d'enchères pour l'inauguration du château de [[Tharass]].
-*24 quinésil
-**Effondrement de la ville du [[royaume de Nalvarune]] suite aux problèmes internes due aux sécessionnistes d'Azurentos.
-**La famille royale excepté le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]] se retire pour construire une villégiature près de [[Nalvarune]] afin de protéger les ruines de la ville.
-*29 quinésil
-**Début de construction d'un quartier résidentiel à [[Osterces]].
-**Signature du [[traité de Vicciopolis]] pour le libre échange entre le [[royaume de Goast]] et le [[royaume de Crusentia]].
-
-===Éposendre===
-
-*1<sup>er</sup> éposendre
-**Mort du roi [[Gaëtan Guillaume Garois|Guillaume Garois I<sup>er</sup>]] et explications de la nouvelle constitution du [[royaume d'Astréa]] avec un pouvoir monarchique absolu et un Sénat consultatif, ainsi que présentation du culte astréen.
-**Canulars du 1<sup>er</sup> avril.
-**Mariage de [[Red 1er|Red I<sup>er</sup>]] et [[Friolon|Magelion d'Orion II]] lors duquel l'ex-roi décède accidentellement. Création d'une journée nationale en [[Royaume de Goast|Goast]] et vague de soutiens internationaux lors de son annonce le 3 éposendre.
-**Effondrement de [[Midgard]], qui est pillée par Algard puis les ressources de laquelle son rendue à son nouveau suzerain : [[Coprincipauté d'Hybloniopolis|Hybloniopolis]].
-
-*2 éposendre, [[Tajir Pa'an]] déclare la [[Commune d'Azurentos]] tandis que la famille royale s'est absentée, commençant la [[crise azurentoise]].
-*3 éposendre, création de la Légion étrangère gaiartoise par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois II]]
-*4 éposendre, érection d'une statue en l'honneur du défunt Red I<sup>er</sup>.
-*5 éposendre
-**La couronne azurentoise déclare l'État d'urgence et la répression anti-insurrection.
-**Annonce des échecs des pourparlers sous l'égide d'[[Industrial-Town]] entre les deux parties impliquées à cause du refus de la couronne azurentoise.
-
-*6 éposendre, 
-**La Panitropole appelle les gaiartois à l'aider pour construire un nouveau port, l'[[évent du port]].
-**Propositions de pourparlers par la couronne azurentoise, refusée par [[Tajir Pa'an]].
-
-*10 éposendre,
-**Proposition de création de l'''Indestructi'Banque'' par [[Friolon|Magelion d'Orion II]].
-**Cushy déclare revendiquer la presque intégralité des territoires anciennement détenus par le royaume de Nalvarune, à l'exception d'[[Elbor]] et Navæden.
-**Passage sous la régence de [[Theopanos Templaris]], de la [[coprincipauté d'Augolia]], qui revendique les anciens territoires de Navæden.
-*13 éposendre, 
-**Tenue du [[Sommet d'Elbor]] lors duquel la [[crise navalraise]] est en partie résolue entre les différents revendicants du territoire.
-**Proposition d'un dernier armistice par la couronne azurentoise, à nouveau refusée par [[Tajir Pa'an]].
-**Le [[royaume de Goast]] propose des pourparlers entre les deux parties impliquées dans la [[crise azurentoise]].
-**Proposition de création d'un tribunal gaiartois pour les futures crises.
-**Attentat destructeur à Issy qui « rédui[t] [le port] en ruines. »<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1229550592670568559|Annonce officielle]] du même jour :« Le port d'Issy, symbole de notre prospérité et de notre connexion au monde, a été gravement endommagé. Une partie de ses installations a été réduite en ruines, provoquant un effondrement brutal et radical. Des vies innocentes ont été perdues, des familles ont été dévastées, et notre cité toute entière est plongée dans le deuil. »</ref>
-
-*16 éposendre, le [[duché de Dolivageä]] adopte par décret ''Louange du Duc'' comme son hymne officiel.
-*17 éposendre, propositions de revendications maritimes par [[Ruki tamashi|Ruki Tamashi]], rejetées par une partie des gaiartois<ref>[[https://discord.com/channels/516302751500599316/1017475737852317768/1230160196354052126|Annonce personnelle]] 5 réactions contre, 4 réactions pour</ref>.
-*24 éposendre, publication des revendications de la tribus des Templaris, sous l'égide de la [[principauté d'Augolia]].
-*25 éposendre, publication des revendications d'[[Elbor]].
-*26 éposendre, publication des revendications d'Industrial-Town
-*28 éposendre
-**Tajir Pa'an se rend aux armées royales d'Azurentos ;
-**Fondation de la Légion étrangère Gaiartoise par le roi [[Gaëtan Guillaume Garois|Gaëtan Garois]].
-
-<references />
-
-```
-
-```
-L''''an 2''' est une année primaire du Calendrier Gaiartois qui commence un dimanche. Elle fait suite à l'[[an 1]] et précède l'[[an 3]].
-
-Elle correspond à l'an 2001 du [[Calendrier Panimorphe]] et les mois de janvier à avril 2023 du [[Calendrier Minecraftien]].
-==Événements==
-===Gaiarkhè===
-
-* 3 gaiarkhè, [[Bleu Azure]] fonde [[la retraite du Démon]].
-* 4 gaiarkhè, [[Kætern d'Ange]] pille [[Frostbourne]] en profitant d'une manipulation de son maire.
-* 16 gaiarkhè
-** [[Kætern d'Ange]] découvre la [[faille de Kætern]].
-** [[Kætern d'Ange]] termine son voyage à travers [[Gaiartos]].
-** [[Kætern d'Ange]] dévoile son premier tableau « [[:Fichier:Le voyage.png|Le Voyage]] ».
-* 18 gaiarkhè, [[Kætern d'Ange]] perd sa main à la bataille de [[Naxos|Naxos-Ouest et Naxos-Est]].
-* 21 gaiarkhè, [[Kætern d'Ange]] obtient sa [[première main en or]].
-
-===Tempopidum===
-
-* 21 tempopidum, début des enchères de [[Kætern d'Ange]].
-* 22 tempopidum, fin des enchères de [[Kætern d'Ange]].
-
-===Quinésil===
-
-* 5 quinésil, la fortune de [[Kætern d'Ange]] dépasse les 500 000[[Fichier:PieceBriocheItem.png|16x16px]].
-* 12 quinésil, naissance du [[Le Renard|Renard]].
-
-===Éposendre===
-
-```
-
-```
-L''''an 1''' est une année tertiaire du Calendrier Gaiartois qui commence un jeudi. Elle fait suite au [[Ier siècle avant N.-C.|I<sup>er</sup> siècle avant N.C.]] et précède l'[[an 2]].
-
-Elle correspond à l'an 2000 du [[Calendrier Panimorphe]] et les mois de septembre à décembre 2022 du [[Calendrier Minecraftien]].
-
-== Événements ==
-
-=== Gaiarkhè ===
-
-* 1 gaiarkhè, [[chute de la Panitropole]] au milieu des quatre continents de [[Gaiartos]].
-* 9 gaiarkhè, '''fin de l'[[Époque intermédiaire|Époque Intermédiaire]].'''
-* 10 gaiarkhè
-** '''Début de l'[[Âge du Renouveau]].'''
-** Début de la [[Nouvelle Colonisation]].
-** Création du [[Calendrier Gaiartois]].
-** [[Deltapythagore]] fonde [[Kappi|X-ray]] sur [[Bulfroï]].
-** [[Osharia]] est pillée et incendiée par les habitants d'[[Kappi|X-ray]].
-** [[Mazer O’Shaw|Mazer O'Shaw]] présente son idée de [[Ligue Gaiartoise]] dans une lettre ouverte.
-* 11 gaiarkhè
-** [[Le Marchand]] fonde la [[tanière du Marchand]] sur [[Munakh]] a l'aide de sa fortune.
-** [[Le Marchand]] approuve l'idée de [[Ligue Gaiartoise]] de [[Mazer O’Shaw|Mazer O'Shaw]] dans une lettre ouverte.
-** [[Bossous]], [[Ludo]] et [[Mazer O’Shaw|Mazer O'Shaw]] fondent [[Midgard]] sur [[Damield]].
-* 12 gaiarkhè la [[première pièce baguette]] depuis la [[Nouvelle Colonisation]] est frappée pour X-ray.
-* 13 gaiarkhè
-** La [[ferme d'Ange]] est pillée et incendiée par les colons d'[[Etherington]].
-** [[Luïa d'Ange]], [[Oswald Quill]] et [[André d'Ange]] décèdent lors du pillage de la [[ferme d'Ange]].
-* 14 gaiarkhè
-** [[Ptah]] fonde [[Ithil]] sur [[Damield]].
-** La Ligue Gaiartoise est fondée par la signature des Accords de la Panitropole par [[Perimars]], [[Mazer O’Shaw|Mazer O'Shaw]], [[Ptah]], [[Bossous]], [[Le Marchand]] et [[Deltapythagore]].
-* 16 gaiarkhè
-** [[Perimars]] et [[Dreeems]] fondent [[Brouswell]] sur [[Nettai]].
-** La [[Panitropole]] reconnait [[Tharass]], ville de [[Damield]].
-** [[Vincentuque]] fonde [[Cacahuète Empire]] sur [[Damield]].
-* 17 gaiarkhè
-** [[Mazer O’Shaw|Mazer O'Shaw]] et [[Pryzri Yzip]] fondent [[Coprincipauté d'Hybloniopolis|Hybloniopolis]] sur [[Damield]].
-** [[Cygale]] fonde [[Végétalia]] sur [[Damield]].
-** [[Giga Zeus]] et [[Ze Atom]] fondent Gigatom qu'ils renomment ensuite [[Jorvik]] sur [[Riquez]].
-** [[Pikachuz4]] fonde [[IndustrialTown]] sur [[Nettai]].
-* 19 gaiarkhè
-** Un guerrier d'[[Kappi|X-ray]] tue un habitant de la [[tanière du Marchand]] lors d'un raid, [[Deltapythagore]] lance un ultimatum a la tanière dans la foulée, celui-ci est contesté par [[Coprincipauté d'Hybloniopolis|Hybloniopolis]], [[IndustrialTown]], [[Jorvik]] et la [[maison SangDragon]].
-** [[Le Marchand]] rencontre [[Red69 Leaf|Red Iᵉʳ]] lors d'une rencontre diplomatique.
-** La [[Panitropole]] reconnait [[Osharia]], ville de [[Munakh]].
-** [[Lui]] renverse la [[Primatie|Primatie Issienne]] d'[[Hisenhorn]] et prend le pouvoir à [[Issy]], ville de [[Munakh]].
-* 20 gaiarkhè
-** [[Drago SangDragon]] fonde le [[Royaume d'Alésia]].
-** [[Kappi|X-ray]] attaque la [[tanière du Marchand]] lors de la [[Guerre des Deux-Heures]] et fini par défaire les défenses de la cité. [[Le Marchand]] et [[PainOraisins]] profitent de la défense pour faire évacuer les marchandises de la tanière qui se retrouve dissoute vers le [[Royaume d'Alésia]].
-** [[AltarusS]] décède en combattant pour la [[tanière du Marchand]] pendant la [[Guerre des Deux-Heures]].
-** [[Ludo]], habitant de la [[tanière du Marchand]], immigre vers [[Issy]].
-** [[Hyelbi]], habitant de la [[tanière du Marchand]], immigre vers [[Brouswell]].
-** La [[Ligue Gaiartoise]] exclut [[Kappi|X-ray]].
-* 22 gaiarkhè
-** [[Drago SangDragon]] fonde [[GrainBeau]] sur [[Riquez]], elle devient la capitale du [[Royaume d'Alésia]].
-** [[Le Marchand]] et [[PainOraisins]] fondent [[Port-Angéis]] sur des ruines sous la tutelle du Royaume d'Alésia.
-** [[Cygale]] termine son exploration de [[Gaiartos]] et partage la [[Première carte de Gaiartos|première carte]] complète.
-* 23 gaiarkhè, [[Bobbyllettrer]] et plusieurs autres habitants de [[Brouswell]] quitte la ville avec une partie de ses ressources pour fonder [[Azuria]] sur [[Bulfroï]].
-* 24 gaiarkhè
-** [[Maximus Maledicto]] fonde [[Frostbourne]] sur [[Riquez]].
-** La première route inter ville depuis la [[Nouvelle Colonisation]] est érigée entre [[GrainBeau]] et [[Port-Angéis]] par le [[Royaume d'Alésia]].
-* 25 gaiarkhè, [[Jorvik]] quitte le [[Royaume d'Alésia]].
-* 27 gaiarkhè, la [[Panitropole]] reconnait [[Port-Angéis]], ville de [[Riquez]].
-* 29 gaiarkhè
-** [[Oskey Ier]] fonde [[Etherington]] sur [[Damield]].
-** [[Spipsycoteck]] fonde [[Issy|Fer-Rouge]] sur [[Nettai]].
-* 30 gaiarkhè
-** [[Spipsycoteck]] fonde le [[Royaume de Fer-Rouge]] avec la [[Issy|ville éponyme]] comme capitale.
-** [[Tortamor]] fonde [[Vicciopolis]] sur [[Nettai]].
-** [[Végétalia]] rejoint le [[Royaume de Fer-Rouge]].
-
-=== Tempopidum ===
-
-* 1ᵉʳ tempopidum
-** La [[Panitropole]] reconnait la Ligue Gaiartois en tant qu'état.
-** Les villes d'[[Etherington]] et [[Alster]] fondent le [[Royaume d'Hussey]].
-*2 tempopidum, [[XiloThor]] fonde [[Demacia]].
-*3 tempopidum, [[Fer-Rouge]] organise les premières enchères depuis la [[Nouvelle Colonisation]] avec les boites mystères.
-*6 tempopidum
-**Le [[Fer-Rouge|Royaume de Fer-Rouge]] et d'[[Royaume d'Hussey|Hussey]] signent le [[Pacte des Enfants de Gehenna]].
-**[[Absolon Enjouvar]] sous le nom de Snaurky infiltre et pille successivement les villes d'[[IndustrialTown]] et [[Brouswell]], ces pillages sont dénoncés a travers la communauté internationale.
-*7 tempopidum
-**Le [[Pacte des Enfants de Gehenna]] déclare [[Absolon Enjouvar]] hors-la-loi.
-**[[Winly]] fonde [[Naxos]].
-**[[Port-Angéis]] organise une fête pour inaugurer l'[[Hôtel de la ligue]] et l'[[Église de l'Ange-Pain]] et honorer le développement marchand de la ville et du reste du monde.
-*8 tempopidum
-**Le [[Royaume de Fer-Rouge]] annonce un ultimatum de 72h contre [[Issy]].
-**En réponse a l'ultimatum du [[Royaume de Fer-Rouge]], les villes d'[[Issy]], [[Azuria]] et [[Kappi|X-ray]] signent un accord de défense nommé [[IXA]].
-* 10 tempopidum, fin de la [[Nouvelle Colonisation]].
-* 11 tempopidum
-** Le [[Pacte des Enfants de Gehenna]] déclare la guerre a [[Issy]] qui n'a pas répondu a l'ultimatum.
-** Début de la [[Guerre de Gehenna]].
-*12 tempopidum
-**L'armée du [[Pacte des Enfants de Gehenna]] s'attaque a [[Issy]] et est repoussée par l'[[IXA]].
-**L'armée de l'[[IXA]] s'attaque a [[IndustrialTown]] et est repoussée par le [[Pacte des Enfants de Gehenna]].
-*13 tempopidum, [[FrostBourne]] fait sécession avec le [[Royaume d'Hussey]] pour se retirer de la [[Guerre de Gehenna]] et fonde le [[Frostbourne|Royaume de Frostbourne]].
-*15 tempopidum
-**L'armée de l'[[IXA]] s'attaque a [[Naxos]] et capture la ville défendue par le [[Pacte des Enfants de Gehenna]].
-**L'armée de l'[[IXA]] s'attaque a [[Alster]] et capture la ville défendue par le [[Pacte des Enfants de Gehenna]].
-*16 tempopidum, [[Incident Rubéonais]].
-
-=== Quinésil ===
-
-=== Éposendre ===
-
-* 15 éposendre, [[Kætern d'Ange]] trouve les objets volés par [[Absolon Enjouvar]] a [[Port-Angéis]].
-
-[[Catégorie:Gaiartos-Histoire]]
-
-```
-Les mois incomplets ou vides le sont pas manque d'historiens (c'est en partie ça cause de ça que tu vas devoirs faire ce job).
-
-Voici maintenant en contexte les messages des 7 derniers jours. Ils ne sont là qu'en contexte, ne les résume pas, mais tu peux t'en servir si besoin :{context_messages_str}
-
-Voici maintenant les messages que tu vas devoir résumer pour le format de Fandom. ATTENTION, dans le résumé, je ne veux que les choses qui devraient être sur le Fandom, donc n'hésite pas à ne pas utiliser les messages peu importants, ou si rien ne s'est passé dans une journée, répond 'NONE' :{messages_to_summarize_str}
-
-
-Je veux que ta liste d'évènements soit sous le même format que le fandom, donc
-* jour mois
-**évènement1
-**évènement2
-**évènement ....
-
-S'il n'y a qu'un seul évènement, alors formatte le :
-* jour mois, évènement
-
-et s'il n'y a rien eu d'intéressant/important alors formatte le :
-* jour mois, NONE
-
-Voilà au boulot, dans ta réponse donne seulement ta réponse formattée sans commentaires additionnels.
-Je rappelle, ta réponse doit être en français, et résumer uniquement les jours à résumer, et pas ceux en contexte.
-
-En fait oublie la réponse pour le fandom, rédige à la place ta réponse à la manière d'un présentateur télé un journal à propos du contenu à résumer, qui présenterait ce qu'il s'est passé dans gaiartos ces derniers temps.
-Voilà une aide pour la forme et le style d'un journal :
-
-
-
-
-
-
-1. **Ouverture et Salutation**
-   - **Phrase d'accroche** : Commencer par une phrase impactante pour capter l'attention.
-   - **Présentation** : Salutation chaleureuse et présentation du présentateur.
-   - **Annonce générale** : Brève mention des événements ou thèmes qui seront abordés.
-
-2. **Développement des Nouvelles**
-   - **Hiérarchisation** : Présenter les informations en commençant par les plus importantes.
-   - **Style narratif** : Utiliser un ton clair, professionnel et engageant.
-   - **Transitions fluides** : Passer d'un sujet à l'autre en douceur, avec des phrases de liaison.
-   - **Éviter les répétitions** : Varier le vocabulaire et les structures de phrases.
-   - **Emphase sur les faits** : Prioriser l'objectivité, en mettant en avant les faits saillants.
-   - **Interactions** : Si approprié, inclure des questions rhétoriques pour impliquer le public.
-
-3. **Conclusion**
-   - **Résumé rapide** : Rappeler les points clés abordés sans entrer dans les détails.
-   - **Note finale** : Terminer sur une pensée positive, une citation inspirante, ou une perspective pour l'avenir.
-   - **Au revoir** : Remercier les téléspectateurs et les inviter à la prochaine édition.
-
----
+# model writing the journal from the day summaries in map_reduce mode
+merge_model = os.getenv('MERGE_MODEL', 'gemini-1.5-flash-002')
 
-**Conseils pour le Style du Présentateur :**
+# cheap model scoring the importance of each Gaiartian day from 0 to 10 before the main model summarizes them
+triage_model = os.getenv('TRIAGE_MODEL', 'gemini-1.5-flash-002')
 
-- **Ton et Langage**
-  - Utiliser un langage accessible mais professionnel.
-  - Maintenir un rythme de parole modéré pour assurer la compréhension.
-  - Employer des tournures de phrases actives pour dynamiser le discours.
+# days scored below this are not sent to the main model, 0 disables the triage
+triage_threshold = int(os.getenv('TRIAGE_THRESHOLD', '0'))
 
-- **Engagement du Public**
-  - Adresser directement les téléspectateurs avec des "vous".
-  - Poser des questions ou utiliser des exclamations pour maintenir l'attention.
+# a score out of 10 anywhere in the answer, "7/10" or "7 sur 10"
+score_out_of_ten_pattern = re.compile(r"(?<!\d)(10|\d)\s*(?:/|sur)\s*10(?!\d)", re.IGNORECASE)
 
-- **Expressions et Intonation**
-  - Varier l'intonation pour souligner l'importance des informations.
-  - Utiliser des expressions faciales et gestuelles (si visuel) pour renforcer le message.
+# otherwise a score from 0 to 10 ending a line, "7" or "17 Tempopidum : 7" when the model repeats the day
+score_pattern = re.compile(r"(?<!\d)(10|\d)\s*\.?\s*$", re.MULTILINE)
 
-- **Flexibilité**
-  - Adapter la longueur et la profondeur des segments en fonction du nombre et de l'importance des événements.
-  - Être prêt à modifier l'ordre des informations si nécessaire pour une meilleure cohérence.
 
-- **Neutralité et Objectivité**
-  - Présenter les informations de manière impartiale.
-  - Éviter les jugements de valeur ou les biais personnels.
+def triage_score(response):
+    """Return the score given by the triage model, or None if the call failed or didn't give one."""
+    if isinstance(response, Exception):
+        return None
+    match = score_out_of_ten_pattern.search(response) or score_pattern.search(response)
+    return int(match.group(1)) if match else None
+
+
+# post the responses while they are being generated instead of waiting for the whole response
+stream_responses = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
 
-Voilà à toi de jouer monsieur le présentateur
-"""
-        print(system_message)
-        async with message.channel.typing():
+# minimum number of seconds between two updates of a streamed response, discord allows about 5 edits per 5 seconds
+stream_update_interval = float(os.getenv('STREAM_UPDATE_INTERVAL', '2'))
+
+
+# discord lets a bot post output_burst messages every output_burst_period seconds in a channel
+output_burst = int(os.getenv('OUTPUT_BURST', '5'))
+output_burst_period = float(os.getenv('OUTPUT_BURST_PERIOD', '5'))
+
+# responses that would take more messages than this are posted as a single file instead
+output_max_messages = int(os.getenv('OUTPUT_MAX_MESSAGES', '5'))
+
+
+def split_for_discord(text, limit=2000):
+    """Pack whole lines of text into as few pieces of at most limit characters as possible.
+
+    Lines too long for a single piece are cut between words.
+    """
+    pieces = []
+    piece = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            # cut after the last space that fits, or in the middle of the word if there is none
+            cut = line.rfind(' ', 0, limit) + 1 or limit
+            if piece:
+                pieces.append(piece)
+                piece = ''
+            pieces.append(line[:cut])
+            line = line[cut:]
+        if len(piece) + len(line) > limit:
+            pieces.append(piece)
+            piece = ''
+        piece += line
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+class SendThrottle:
+    """Spaces out the messages posted in each channel so they stay within its rate-limit bucket."""
+
+    def __init__(self):
+        # when the last output_burst messages were posted, by channel id
+        self.sent_at = defaultdict(deque)
+
+    async def send(self, channel, metrics, content=None, **kwargs):
+        sent_at = self.sent_at[channel.id]
+        now = time.monotonic()
+        while sent_at and sent_at[0] <= now - output_burst_period:
+            sent_at.popleft()
+        if len(sent_at) >= output_burst:
+            # wait for the oldest message to leave the bucket
+            await asyncio.sleep(sent_at.popleft() + output_burst_period - now)
+        sent_at.append(time.monotonic())
+        metrics.counters['discord_sends'] += 1
+        return await channel.send(content, **kwargs)
+
+
+send_throttle = SendThrottle()
+
+
+class ProgressiveSender:
+    """Posts a streamed response in a channel as its lines complete, editing the last message while it grows.
+
+    Updates are coalesced so there is at most one every stream_update_interval seconds.
+    """
+
+    def __init__(self, channel, metrics):
+        self.channel = channel
+        self.metrics = metrics
+        self.text = ''
+        # (discord message, content) of the messages posted so far
+        self.sent_messages = []
+        self.last_update = 0
+
+    async def feed(self, chunk):
+        self.text += chunk
+        if time.monotonic() - self.last_update >= stream_update_interval:
+            # only publish complete lines, the last one might still be cut in the middle of a word
+            await self.update(self.text[:self.text.rfind('\n') + 1])
+
+    async def finish(self):
+        await self.update(self.text)
+
+    async def update(self, text):
+        if not text.strip():
+            return
+        self.last_update = time.monotonic()
+        # lines are only ever added at the end, so only the last piece changes while the text grows
+        pieces = split_for_discord(text)
+        for i, piece in enumerate(pieces):
+            if i < len(self.sent_messages):
+                sent_message, content = self.sent_messages[i]
+                if content != piece:
+                    await sent_message.edit(content=piece)
+                    self.sent_messages[i] = (sent_message, piece)
+                    self.metrics.counters['discord_edits'] += 1
+            else:
+                self.sent_messages.append((await send_throttle.send(self.channel, self.metrics, piece), piece))
+
+
+# where the metrics of every command run are written, as JSON lines and as a Prometheus text file
+metrics_jsonl_path = os.getenv('METRICS_JSONL_PATH', 'metrics.jsonl')
+metrics_prometheus_path = os.getenv('METRICS_PROMETHEUS_PATH', 'metrics.prom')
+
+
+class RunMetrics:
+    """Metrics of one command run, exported when the run finishes."""
+
+    # last finished run of each command, they are all written to the Prometheus file
+    last_runs = {}
+
+    def __init__(self, command):
+        self.command = command
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.usage = TokenUsage()
+        # seconds spent in each stage
+        self.latencies = defaultdict(float)
+        # messages_fetched, messages_from_archive and history_pages, by channel name
+        self.channels = defaultdict(Counter)
+        # discord_sends, errors...
+        self.counters = Counter(discord_sends=0, errors=0)
+        # last stage entered, shown by $status
+        self.current_stage = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latencies[name] += time.perf_counter() - start
+
+    def to_dict(self):
+        return {
+            'command': self.command,
+            'started_at': self.started_at.isoformat(),
+            'latencies': dict(self.latencies),
+            'channels': {name: dict(counts) for name, counts in self.channels.items()},
+            'prompt_tokens': self.usage.prompt_tokens,
+            'cached_tokens': self.usage.cached_tokens,
+            'response_tokens': self.usage.response_tokens,
+            **self.counters,
+        }
+
+    def to_prometheus(self):
+        """Return the metrics as Prometheus samples, (name, labels, value)."""
+        samples = [('laboulangerie_run_timestamp_seconds', {}, self.started_at.timestamp())]
+        samples += [('laboulangerie_run_duration_seconds', {'stage': stage}, seconds)
+                    for stage, seconds in self.latencies.items()]
+        for channel_name, counts in self.channels.items():
+            samples += [(f'laboulangerie_run_{name}', {'channel': channel_name}, value)
+                        for name, value in counts.items()]
+        samples += [('laboulangerie_run_tokens', {'kind': 'prompt'}, self.usage.prompt_tokens),
+                    ('laboulangerie_run_tokens', {'kind': 'cached'}, self.usage.cached_tokens),
+                    ('laboulangerie_run_tokens', {'kind': 'response'}, self.usage.response_tokens)]
+        samples += [(f'laboulangerie_run_{name}', {}, value) for name, value in self.counters.items()]
+        return [(name, {'command': self.command, **labels}, value) for name, labels, value in samples]
+
+    def finish(self):
+        """Append the run to the JSON lines file and rewrite the Prometheus file with the last run of each command."""
+        self.latencies['total'] = time.perf_counter() - self.start
+        with open(metrics_jsonl_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(self.to_dict(), ensure_ascii=False) + '\n')
+
+        RunMetrics.last_runs[self.command] = self
+        samples_by_name = defaultdict(list)
+        for run in RunMetrics.last_runs.values():
+            for name, labels, value in run.to_prometheus():
+                samples_by_name[name].append((labels, value))
+        lines = []
+        for name, samples in samples_by_name.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                labels_str = ','.join(f'{key}="{escape_label_value(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{labels_str}}} {value}")
+        # written next to the file then renamed, so the collector never reads a half-written file
+        with open(metrics_prometheus_path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(metrics_prometheus_path + '.tmp', metrics_prometheus_path)
+
+        print(f"{self.command}: {self.latencies['total']:.1f}s ("
+              + ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in self.latencies.items() if stage != 'total')
+              + f"), {sum(counts['messages_fetched'] for counts in self.channels.values())} messages fetched, "
+              + self.usage.report() + f", {self.counters['discord_sends']} messages sent, "
+              + f"{self.counters['errors']} errors")
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# number of commands that can be processed at the same time
+command_workers = int(os.getenv('COMMAND_WORKERS', '2'))
+
+
+# number of seconds a fetched and formatted window is reused by the next commands
+snapshot_ttl = float(os.getenv('SNAPSHOT_TTL', '300'))
+
+
+class Snapshot:
+    """The window of messages of a run fetched, split and formatted once, shared by the commands run while it's fresh.
+    """
+
+    def __init__(self, to_summarize_by_channel, context_by_channel):
+        self.taken_at = time.monotonic()
+        self.to_summarize_by_channel = to_summarize_by_channel
+        self.context_by_channel = context_by_channel
+        # formatted messages by id, filled as the prompts are built
+        self.formatted = {}
+        self.messages_to_summarize_str = None
+        # task scoring the days with the triage model, shared by the commands using the snapshot
+        self.triage_task = None
+
+    @functools.cached_property
+    def days(self):
+        """Messages to summarize by Gaiartian day, for the map-reduce mode."""
+        return group_messages_by_gaiartian_day(self.to_summarize_by_channel)
+
+    def is_fresh(self):
+        return time.monotonic() - self.taken_at < snapshot_ttl
+
+
+# maximum number of commands waiting to be processed, the next ones are refused
+job_queue_size = int(os.getenv('JOB_QUEUE_SIZE', '4'))
+
+
+class Job:
+    """A command queued or running, as listed by $status."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, name, command, message):
+        self.id = next(Job.ids)
+        self.name = name
+        self.command = command
+        self.message = message
+        self.queued_at = time.monotonic()
+        # set when the job starts running
+        self.metrics = None
+        self.task = None
+
+    def state(self):
+        return 'queued' if self.task is None else 'running'
+
+    def describe(self):
+        if self.metrics is None:
+            return f"#{self.id} {self.name}: queued for {time.monotonic() - self.queued_at:.0f}s"
+        return (f"#{self.id} {self.name}: running for {time.perf_counter() - self.metrics.start:.0f}s, "
+                f"stage {self.metrics.current_stage or 'starting'}")
+
+
+class MyClient(discord.Client):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # commands waiting to be processed
+        self.job_queue = asyncio.Queue(maxsize=job_queue_size)
+        self.job_workers = []
+        # jobs queued or running, by id
+        self.jobs = {}
+        # task taking the last snapshot of the window, shared by the commands while it's fresh
+        self.snapshot_task = None
+        self.digest_task = None
+
+    async def setup_hook(self):
+        for _ in range(command_workers):
+            self.job_workers.append(asyncio.create_task(self.process_jobs()))
+        if digest_interval_hours:
+            self.digest_task = asyncio.create_task(self.schedule_digests())
+
+    async def on_ready(self):
+        print('Logged on as', self.user)
+        try:
+            await asyncio.get_running_loop().run_in_executor(generation_executor, llm_backend.warm_up)
+        except Exception as e:
+            print(f"Could not warm up the Gemini connection: {e}")
+
+    async def on_message(self, message: Message):
+        # check if the message is from the controller id or the bot if allowed
+        if (can_bot_control_itself and message.author.id == self.user.id) or (
+                str(message.author.id) == str(controller_id)):
+            if str(message.channel.id) == str(controller_channel_id):
+                # commands are queued so on_message returns right away and the gateway stays responsive
+                if message.content == "$summarize":
+                    await self.queue_job("$summarize", self.summarize, message)
+                if message.content == "$journal":
+                    await self.queue_job("$journal", self.journal, message)
+                if message.content == "$status":
+                    await message.channel.send(self.status())
+                if message.content.startswith("$cancel"):
+                    await self.cancel_job(message)
+                if message.content == "$retry":
+                    await self.queue_job("$retry", self.retry, message)
+                if message.content.startswith("$page"):
+                    await self.send_year_page(message)
+
+    async def queue_job(self, name, command, message):
+        """Queue a command, unless the same one is already queued or running or the queue is full."""
+        for job in self.jobs.values():
+            if job.name == name:
+                await message.channel.send(f"{name} is already {job.state()} (job #{job.id}), "
+                                           f"its result will be posted here.")
+                return
+        job = Job(name, command, message)
+        try:
+            self.job_queue.put_nowait(job)
+        except asyncio.QueueFull:
+            await message.channel.send(f"Too many commands waiting, {name} was not queued.")
+            return
+        self.jobs[job.id] = job
+
+    def status(self):
+        """Return the list of the queued and running jobs."""
+        if not self.jobs:
+            return "No command queued or running."
+        return '\n'.join([job.describe() for job in self.jobs.values()] + ["Type $cancel <job number> to cancel one."])
+
+    async def cancel_job(self, message):
+        """Cancel the job whose number follows $cancel, whether it's queued or running."""
+        job_id = message.content.removeprefix("$cancel").strip()
+        job = self.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            await message.channel.send(f"No job #{job_id} queued or running.")
+        elif job.task is None:
+            # the worker skips the jobs that are not in self.jobs anymore
+            del self.jobs[job.id]
+            await message.channel.send(f"Job #{job.id} ({job.name}) cancelled.")
+        else:
+            # the worker reports it once the job has stopped
+            job.task.cancel()
+
+    async def send_year_page(self, message):
+        """Send the events section of the page of the Gaiartian year following $page, the current one by default,
+        built from the event store."""
+        year = message.content.removeprefix("$page").strip()
+        if not year.lstrip('-').isdigit():
+            year, _, _ = calculate_gaiartian_date(datetime.now(timezone.utc))
+        metrics = RunMetrics('page')
+        try:
+            page = event_store.build_year_page(int(year))
+            await self.send_response(message.channel, page, metrics, f"An {year}.wiki")
+        finally:
+            metrics.finish()
+
+    async def process_jobs(self):
+        """Worker loop running the queued commands one after the other."""
+        while True:
+            job = await self.job_queue.get()
             try:
-                response = generate_response("Procède.", system_message)
-                print(response)
-                if len(response) > 2000:
-                    # send multiple messages in a row instead
-                    for i in range(0, len(response), 2000):
-                        await message.channel.send(response[i:i + 2000])
-                else:
-                    await message.channel.send(response)
-            except Exception as e:
-                await message.channel.send(f"Error: {e}")
+                if job.id not in self.jobs:
+                    continue
+                job.metrics = RunMetrics(job.name.lstrip('$'))
+                # the command runs in its own task so it can be cancelled without stopping the worker
+                job.task = asyncio.create_task(job.command(job.message, job.metrics))
+                await asyncio.wait([job.task])
+                if job.task.cancelled():
+                    await job.message.channel.send(f"Job #{job.id} ({job.name}) cancelled.")
+                elif job.task.exception() is not None:
+                    print(f"Error while running {job.name}: {job.task.exception()}")
+            finally:
+                self.jobs.pop(job.id, None)
+                self.job_queue.task_done()
+
+    async def on_raw_message_edit(self, payload):
+        # keep the archive in sync with edits of messages it already holds, the raw event also fires for messages
+        # that are no longer in discord's message cache
+        message_archive.update_content(payload.channel_id, payload.message_id, self.resolve_mentions(payload.message))
+        self.invalidate_snapshot(payload.channel_id)
+
+    async def on_raw_message_delete(self, payload):
+        message_archive.delete_message(payload.channel_id, payload.message_id)
+        self.invalidate_snapshot(payload.channel_id)
+
+    def invalidate_snapshot(self, channel_id):
+        """Make the next command take a new snapshot if a message of the summarized channels changed."""
+        if channel_id in channel_ids and self.snapshot_task is not None and self.snapshot_task.done():
+            self.snapshot_task = None
+
+    async def get_messages_since_last_x_hours(self, channel_id, hours, metrics=None, now=None):
+        """Fetch and return all messages in a specific channel from the X hours before now.
+
+        Messages already in the local archive are served from disk, only the missing ones are fetched from discord.
+        """
+        channel = self.get_channel(channel_id)
+        if not channel:
+            print(f"Channel with ID {channel_id} not found.")
+            return []
+
+        # Turn the window into snowflakes so discord only returns the messages inside it
+        now = now or datetime.now(timezone.utc)
+        time_threshold = now - timedelta(hours=hours)
+        after_id = discord.utils.time_snowflake(time_threshold) - 1
+        before_id = discord.utils.time_snowflake(now, high=True) + 1
+
+        covered_since, newest_id = message_archive.get_coverage(channel_id)
+        fetched = 0
+        history_pages = 0
+
+        # Fetch the new messages posted since the last run, from the start of the coverage if none were archived (the
+        # window was empty or its messages were all deleted)
+        if newest_id is not None or covered_since is not None:
+            after = newest_id if newest_id is not None else discord.utils.time_snowflake(covered_since)
+            if after < after_id:
+                # the last run is older than the window, the messages in between aren't needed. The archive now
+                # covers the window only, recorded before the walk so an interrupted walk doesn't leave a hole
+                after = after_id
+                covered_since = time_threshold
+                message_archive.set_covered_since(channel_id, covered_since)
+            fetched, history_pages = await self.walk_history(channel, after=after, before=before_id)
+
+        # If the archive doesn't go back far enough, fetch the older messages from most recent to oldest, starting
+        # where an interrupted walk stopped if there is one
+        if covered_since is None or time_threshold < covered_since:
+            checkpoint = message_archive.get_checkpoint(channel_id)
+            if checkpoint:
+                before = checkpoint
+            elif covered_since:
+                before = discord.utils.time_snowflake(covered_since)
+            else:
+                before = before_id
+            old_fetched, old_pages = await self.walk_history(channel, before=before, until=after_id)
+            message_archive.set_covered_since(channel_id, time_threshold)
+            fetched += old_fetched
+            history_pages += old_pages
+
+        # Messages come back from oldest to newest
+        messages = message_archive.get_messages_between(channel_id, after_id, before_id)
+        if metrics is not None:
+            metrics.channels[channel.name].update(messages_fetched=fetched, history_pages=history_pages,
+                                                  messages_from_archive=len(messages) - fetched)
+        return messages
+
+    async def walk_history(self, channel, before, after=None, until=None):
+        """Walk a channel history, storing each page of messages in the archive as soon as it's fetched.
+
+        Walks forwards from the message id after up to the message id before, or backwards from before down to the
+        message id until, checkpointing the oldest message reached. Rate limits and connection errors are retried, the
+        walk resuming from the last stored page. Returns (messages fetched, history pages).
+        """
+        fetched = 0
+        history_pages = 0
+        retries = 0
+        while True:
+            page = []
+            try:
+                # discord stops at the bounds itself, from oldest to newest when walking forwards
+                forwards = after is not None
+                async for message in channel.history(limit=None, before=discord.Object(id=before),
+                                                     after=discord.Object(id=after if forwards else until),
+                                                     oldest_first=forwards):
+                    page.append(self.archive_message(message))
+                    # discord returns the history by pages of 100 messages
+                    if len(page) == 100:
+                        before, after = self.store_history_page(channel, page, before, after)
+                        fetched += len(page)
+                        history_pages += 1
+                        page = []
+                        retries = 0
+                before, after = self.store_history_page(channel, page, before, after)
+                return fetched + len(page), history_pages + 1
+            except (discord.HTTPException, discord.RateLimited, aiohttp.ClientError, asyncio.TimeoutError,
+                    OSError) as e:
+                if isinstance(e, discord.HTTPException) and e.status != 429 and e.status < 500:
+                    raise
+                # what was fetched before the error is kept, the walk resumes right after it
+                before, after = self.store_history_page(channel, page, before, after)
+                fetched += len(page)
+                retries += 1
+                if retries > history_fetch_retries:
+                    raise
+                delay = history_retry_delay(e, retries)
+                print(f"Fetching #{channel.name} failed ({e}), resuming in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def store_history_page(self, channel, page, before, after):
+        """Store a page of a history walk and return the (before, after) bounds to resume the walk from."""
+        if not page:
+            return before, after
+        message_archive.store_messages(page)
+        if after is not None:
+            return before, max(message.id for message in page)
+        oldest_id = min(message.id for message in page)
+        message_archive.set_checkpoint(channel.id, oldest_id)
+        return oldest_id, after
+
+    async def fetch_channels(self, channel_ids, hours, metrics=None, now=None):
+        """Fetch the messages of several channels concurrently, returning them by channel name."""
+        # every channel shares the same window
+        now = now or datetime.now(timezone.utc)
+
+        async def fetch(channel_id):
+            async with history_fetch_semaphore:
+                return await self.get_messages_since_last_x_hours(channel_id, hours, metrics, now)
+
+        results = await asyncio.gather(*(fetch(channel_id) for channel_id in channel_ids))
+
+        messages_by_channel = {}
+        for channel_id, messages in zip(channel_ids, results):
+            # Get the channel name
+            channel = self.get_channel(channel_id)
+            channel_name = channel.name if channel else f"Channel {channel_id}"
+            messages_by_channel[channel_name] = messages
+        return messages_by_channel
 
+    def resolve_mentions(self, message):
+        """Return the content of a message with user, role and channel mentions replaced by their names.
 
+        Every mention is rewritten in a single pass over the content.
+        """
+        # the objects given with the message have the freshest names, they refresh the cache
+        for user in message.mentions:
+            name_cache.put(('@', user.id), user.display_name)
+        for role in message.role_mentions:
+            name_cache.put(('@&', role.id), role.name)
+        for channel in message.channel_mentions:
+            name_cache.put(('#', channel.id), channel.name)
+
+        return mention_pattern.sub(lambda match: self.resolve_mention(match, message.guild), message.content)
+
+    def resolve_mention(self, match, guild):
+        """Return the name a mention token refers to, or the token itself if it can't be resolved."""
+        # <@id> and <@!id> are both user mentions
+        kind = '@' if match[1] == '@!' else match[1]
+        key = (kind, int(match[2]))
+        name = name_cache.get(key)
+        if name is None:
+            if kind == '@':
+                user = (guild and guild.get_member(key[1])) or self.get_user(key[1])
+                name = user and user.display_name
+            elif kind == '@&':
+                role = guild and guild.get_role(key[1])
+                name = role and role.name
+            else:
+                channel = self.get_channel(key[1])
+                name = channel and channel.name
+            if name is None:
+                return match[0]
+            name_cache.put(key, name)
+        return f"{'#' if kind == '#' else '@'}{name}"
+
+    def archive_message(self, message):
+        """Convert a discord message into an ArchivedMessage."""
+        return ArchivedMessage(message.id, message.channel.id, message.created_at, message.author.display_name,
+                               self.resolve_mentions(message), message.author.bot)
 
+    async def format_message(self, message):
+        """Format a single archived message with username, Gaiartian date, and content."""
+        content = message.content
 
+        # Get Gaiartian date components (year, day, month)
+        year, day, month = calculate_gaiartian_date(message.created_at)
 
+        # Get the time part (hours, minutes, seconds)
+        time_part = message.created_at.strftime("%H:%M:%S")
 
+        # Format message in "[An X, le DAY de month_name à time]: message content" format
+        formatted_message = f"{message.author_name} [An {year}, le {day} de {month} à {time_part}]:\n{content}"
 
+        return formatted_message
 
+    async def schedule_digests(self):
+        """Background loop running a digest every digest_interval_hours hours, catching up on startup if one is due."""
+        await self.wait_until_ready()
+        while True:
+            last_run = digest_log.get_last_run()
+            if last_run is not None:
+                next_run = last_run + timedelta(hours=digest_interval_hours)
+                await asyncio.sleep(max(0.0, (next_run - datetime.now(timezone.utc)).total_seconds()))
+            await self.digest()
+            if digest_log.get_last_run() == last_run:
+                # the digest failed, try again at the next interval
+                await asyncio.sleep(digest_interval_hours * 3600)
+
+    async def digest(self):
+        """Summarize the messages posted since the last digest and append the summary to the digest log."""
+        metrics = RunMetrics('digest')
+        now = metrics.started_at
+        last_run = digest_log.get_last_run()
+        # the first digest covers the usual window
+        new_hours = (now - last_run).total_seconds() / 3600 if last_run else hours_to_summarize
+        try:
+            with metrics.stage('fetch'):
+                messages_by_channel = await self.fetch_channels(channel_ids, max(context_hours, new_hours), metrics,
+                                                                now)
+
+            new_messages = {}
+            context_messages = {}
+            with metrics.stage('split'):
+                for channel_name, messages in messages_by_channel.items():
+                    new_messages[channel_name], context_messages[channel_name] = await split_messages_by_hours(
+                        messages, new_hours, now)
+            new_messages, context_messages = self.remove_noise(new_messages, context_messages, metrics)
+
+            summary = ''
+            if any(new_messages.values()):
+                # both blocks of the prompt share the aliases of the authors
+                formatted = {}
+                messages_to_summarize_str = await self.build_messages_str(new_messages, metrics, formatted)
+                system_instruction, user_input = await self.build_packed_prompt(
+                    build_summary_prompt, context_messages, new_messages, messages_to_summarize_str, metrics, formatted)
+                with metrics.stage('generation'):
+                    summary = await generate_response_async(user_input, system_instruction, usage=metrics.usage)
+                summary = summary.strip()
+            year, _, _ = calculate_gaiartian_date(now)
+            digest_log.append(now, year, summary)
+            # a digest only covers the messages posted since the previous one, its events add to the stored ones
+            event_store.add_events(parse_fandom_events(summary, now))
+        except Exception as e:
+            metrics.counters['errors'] += 1
+            print(f"Digest failed: {e}")
+        finally:
+            metrics.finish()
+
+    async def take_snapshot(self, metrics):
+        """Return the window of messages fetched, split and formatted.
+
+        The snapshot taken by a previous command is reused while it's fresh, and commands running at the same time
+        wait for the same one.
+        """
+        task = self.snapshot_task
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None
+                                             or not task.result().is_fresh())):
+            self.snapshot_task = task = asyncio.create_task(self.build_snapshot(metrics))
+        else:
+            metrics.counters['snapshot_hits'] += 1
+        # a cancelled command must not cancel the snapshot the other ones are waiting for
+        return await asyncio.shield(task)
 
-client = MyClient()
+    async def build_snapshot(self, metrics):
+        with metrics.stage('fetch'):
+            # Fetch every channel at once
+            messages_by_channel = await self.fetch_channels(channel_ids, context_hours, metrics, metrics.started_at)
 
-# Run the client using the token
-client.run(TOKEN)  # bot=False means it runs as a user account
+        # Initialize dictionaries to store messages by channel name
+        all_messages_to_summarize = {}
+        all_messages_as_context = {}
 
-print("hello")
+        with metrics.stage('split'):
+            for channel_name, messages in messages_by_channel.items():
+                # Split messages into those to summarize and context messages
+                messages_to_summarize, messages_as_context = await split_messages_by_hours(messages,
+                                                                                           hours_to_summarize,
+                                                                                           metrics.started_at)
+                all_messages_to_summarize[channel_name] = messages_to_summarize
+                all_messages_as_context[channel_name] = messages_as_context
+
+        all_messages_to_summarize, all_messages_as_context = self.remove_noise(all_messages_to_summarize,
+                                                                               all_messages_as_context, metrics)
+        snapshot = Snapshot(all_messages_to_summarize, all_messages_as_context)
+        snapshot.messages_to_summarize_str = await self.build_messages_str(all_messages_to_summarize, metrics,
+                                                                           snapshot.formatted)
+        return snapshot
+
+    async def triage(self, snapshot, metrics):
+        """Return the snapshot without the days the triage model scored below triage_threshold.
+
+        The days of a snapshot are only scored once, for every command using it.
+        """
+        if snapshot.triage_task is None:
+            snapshot.triage_task = asyncio.create_task(self.score_days(snapshot, metrics))
+        return await asyncio.shield(snapshot.triage_task)
+
+    async def score_days(self, snapshot, metrics):
+        day_strs = {day: await self.build_messages_str(day_messages, metrics, snapshot.formatted)
+                    for day, day_messages in snapshot.days.items()}
+        with metrics.stage('triage'):
+            # a failed call keeps the day, the triage must not lose events
+            responses = await asyncio.gather(*(
+                generate_response_async(day_str, load_template('triage'), model=triage_model, usage=metrics.usage)
+                for day_str in day_strs.values()), return_exceptions=True)
+
+        kept_by_channel = defaultdict(list)
+        kept_days = 0
+        total_tokens = 0
+        saved_tokens = 0
+        for (day, day_str), response in zip(day_strs.items(), responses):
+            score = triage_score(response)
+            tokens = estimate_tokens(day_str)
+            total_tokens += tokens
+            if score is not None and score < triage_threshold:
+                saved_tokens += tokens
+                continue
+            kept_days += 1
+            # days are in chronological order so the messages stay sorted
+            for channel_name, messages in snapshot.days[day].items():
+                kept_by_channel[channel_name].extend(messages)
+
+        metrics.counters['triage_days_dropped'] += len(day_strs) - kept_days
+        metrics.counters['triage_tokens_saved'] += saved_tokens
+        print(f"Triage: kept {kept_days}/{len(day_strs)} days, saved ~{saved_tokens} of ~{total_tokens} "
+              f"tokens of messages for the main model ({saved_tokens / max(total_tokens, 1):.0%})")
+
+        triaged = Snapshot({channel_name: kept_by_channel[channel_name]
+                            for channel_name in snapshot.to_summarize_by_channel}, snapshot.context_by_channel)
+        triaged.formatted = snapshot.formatted
+        triaged.messages_to_summarize_str = await self.build_messages_str(triaged.to_summarize_by_channel, metrics,
+                                                                          triaged.formatted)
+        return triaged
+
+    async def run_command(self, message, metrics, build_prompt, filename, reduce):
+        """Shared body of the commands, each one only bringing its prompt.
+
+        In single mode the whole window is sent with build_prompt, in map-reduce mode each day is summarized then
+        reduce is called with the day summaries. Returns the response sent, or None if the command failed.
+        """
+        async with message.channel.typing():
+            try:
+                snapshot = await self.take_snapshot(metrics)
+                if triage_threshold:
+                    snapshot = await self.triage(snapshot, metrics)
+                if not any(snapshot.to_summarize_by_channel.values()):
+                    # nothing worth summarizing, no need to call the main model
+                    await self.send_response(message.channel, "NONE", metrics, filename)
+                    return "NONE"
+                if summary_mode == "map_reduce":
+                    return await reduce(await self.summarize_by_day(snapshot, metrics))
+                prompt = await self.build_packed_prompt(build_prompt, snapshot.context_by_channel,
+                                                        snapshot.to_summarize_by_channel,
+                                                        snapshot.messages_to_summarize_str, metrics,
+                                                        snapshot.formatted)
+                return await self.generate_and_send(message.channel, prompt, metrics, filename)
+            except Exception as e:
+                metrics.counters['errors'] += 1
+                await message.channel.send(f"Error: {e}")
+            finally:
+                metrics.finish()
+
+    async def summarize(self, message, metrics=None):
+        metrics = metrics or RunMetrics('summarize')
+        if digest_interval_hours:
+            # the scheduled digests already summarized the current Gaiartian year, no need to wait for Gemini
+            year, _, _ = calculate_gaiartian_date(metrics.started_at)
+            digests = digest_log.get_year(year)
+            if digests:
+                try:
+                    await self.send_response(message.channel, digests, metrics, 'summary.wiki')
+                finally:
+                    metrics.finish()
+                return
+
+        async def reduce(day_summaries):
+            # the day summaries already follow the fandom format, they only need to be put back together
+            response = '\n'.join(day_summaries) or "NONE"
+            await self.send_response(message.channel, response, metrics, 'summary.wiki')
+            return response
+
+        response = await self.run_command(message, metrics, build_summary_prompt, 'summary.wiki', reduce)
+        if response:
+            # keep the events so the year pages can be built without asking Gemini again, the whole window is
+            # summarized again each time so the new summary of a day replaces the old one
+            event_store.add_events(parse_fandom_events(response, metrics.started_at),
+                                   metrics.started_at - timedelta(hours=hours_to_summarize))
+
+    async def journal(self, message, metrics=None):
+        metrics = metrics or RunMetrics('journal')
+
+        async def reduce(day_summaries):
+            # a cheaper model writes the journal from the day summaries instead of the raw messages
+            prompt = build_journal_prompt("", '\n' + '\n'.join(day_summaries))
+            return await self.generate_and_send(message.channel, prompt, metrics, 'journal.txt', model=merge_model)
+
+        await self.run_command(message, metrics, build_journal_prompt, 'journal.txt', reduce)
+
+    async def generate_and_send(self, channel, prompt, metrics, filename='response.txt', **kwargs):
+        """Generate a response and post it in the channel, while it's being generated if streaming is enabled.
+
+        If the generation fails, the prompt is kept for $retry.
+        """
+        system_instruction, user_input = prompt
+        try:
+            if stream_responses:
+                sender = ProgressiveSender(channel, metrics)
+                # generating and sending are interleaved, it's all counted as generation
+                with metrics.stage('generation'):
+                    async for chunk in stream_response_async(user_input, system_instruction, usage=metrics.usage,
+                                                             **kwargs):
+                        await sender.feed(chunk)
+                    await sender.finish()
+                return sender.text
+
+            with metrics.stage('generation'):
+                response = await generate_response_async(user_input, system_instruction, usage=metrics.usage,
+                                                         **kwargs)
+        except Exception as e:
+            failed_prompts.save(metrics.command, filename, kwargs.get('model'), prompt)
+            raise RuntimeError(f"{e!r}, type $retry to try again without fetching the messages") from e
+        await self.send_response(channel, response, metrics, filename)
+        return response
+
+    async def retry(self, message, metrics=None):
+        """Generate and send again the last prompt whose generation failed. The run counts as one of the command
+        that built the prompt."""
+        metrics = metrics or RunMetrics('retry')
+        failed = failed_prompts.get_last()
+        if failed is None:
+            await message.channel.send("No failed prompt to retry.")
+            return
+        failed_at, metrics.command, filename, model, prompt = failed
+        # saved again if it fails again
+        failed_prompts.delete(failed_at)
+        # the prompt holds the window of the run that built it
+        built_at = datetime.fromtimestamp(failed_at, timezone.utc)
+        kwargs = {'model': model} if model else {}
+        async with message.channel.typing():
+            try:
+                response = await self.generate_and_send(message.channel, prompt, metrics, filename, **kwargs)
+                if metrics.command == 'summarize':
+                    event_store.add_events(parse_fandom_events(response, built_at),
+                                           built_at - timedelta(hours=hours_to_summarize))
+            except Exception as e:
+                metrics.counters['errors'] += 1
+                await message.channel.send(f"Error: {e}")
+            finally:
+                metrics.finish()
+
+    async def send_response(self, channel, response, metrics, filename='response.txt'):
+        """Post a response in as few messages as possible, or as a file named filename if it's too long."""
+        with metrics.stage('send'):
+            pieces = split_for_discord(response)
+            if len(pieces) > output_max_messages:
+                await send_throttle.send(channel, metrics,
+                                         file=discord.File(io.BytesIO(response.encode()), filename=filename))
+                return
+            for piece in pieces:
+                await send_throttle.send(channel, metrics, piece)
+
+    def remove_noise(self, to_summarize_by_channel, context_by_channel, metrics):
+        """Apply the noise filter to the messages to summarize and the context messages, reporting what it removed."""
+        removed = defaultdict(Counter)
+        with metrics.stage('filter'):
+            to_summarize_by_channel = filter_noise(to_summarize_by_channel, removed)
+            context_by_channel = filter_noise(context_by_channel, removed)
+        for rule, counts in removed.items():
+            metrics.counters[f'noise_{rule}_messages'] += counts['messages']
+            metrics.counters[f'noise_{rule}_tokens'] += counts['tokens']
+        print(noise_report(removed))
+        return to_summarize_by_channel, context_by_channel
+
+    async def build_messages_str(self, messages_by_channel, metrics, formatted=None):
+        """Format messages and join them in one block per channel, as they are given in the prompts.
+
+        formatted caches what is formatted from each message by id and the aliases of the authors, for the prompts
+        built from the same snapshot.
+        """
+        formatted = {} if formatted is None else formatted
+        with metrics.stage('format'):
+            if transcript_format != 'verbose':
+                return compact_transcript(messages_by_channel, formatted)
+            messages_str = ''
+            for channel_name, messages in messages_by_channel.items():
+                for m in messages:
+                    if m.id not in formatted:
+                        formatted[m.id] = await self.format_message(m)
+                messages_str += f"\n#{channel_name} :\n"
+                messages_str += '\n'.join([formatted[m.id] for m in messages])
+            return messages_str
+
+    async def build_packed_prompt(self, build_prompt, context_by_channel, to_summarize_by_channel,
+                                  messages_to_summarize_str, metrics, formatted=None, context_budget=None):
+        """Build a prompt, packing the context messages into the token budget left by the rest of the prompt.
+
+        context_budget replaces context_token_budget, for prompts sharing the context budget between them.
+        """
+        prompt_tokens = sum(estimate_tokens(part) for part in build_prompt("", messages_to_summarize_str))
+        token_budget = min(context_budget or context_token_budget, model_input_token_limit - prompt_tokens)
+        if token_budget < 0:
+            raise ValueError(f"The prompt is too large for the model (~{prompt_tokens} tokens for a limit of "
+                             f"{model_input_token_limit}), try SUMMARY_MODE=map_reduce or fewer hours to summarize")
+
+        with metrics.stage('pack'):
+            # ranking thousands of messages takes a while, the event loop keeps answering discord meanwhile
+            packed_context, report = await asyncio.to_thread(pack_context, context_by_channel, to_summarize_by_channel,
+                                                             token_budget)
+        print(report)
+        context_messages_str = await self.build_messages_str(packed_context, metrics, formatted)
+        return build_prompt(context_messages_str, messages_to_summarize_str)
+
+    async def summarize_by_day(self, snapshot, metrics):
+        """Map step of the map-reduce mode: summarize each Gaiartian day of a snapshot on its own, all days at the
+        same time.
+
+        Each day is given the context messages of the run and the previous day, packed into an equal share of the
+        context budget. Days whose messages didn't change since a previous run are taken from the day summary cache,
+        whatever their context: it moves with the window on every run, and only helps to understand the day.
+        Returns the day summaries in chronological order.
+        """
+        channel_set = ','.join(sorted(snapshot.to_summarize_by_channel))
+        day_summaries = []
+        # (index in day_summaries, day, content hash, prompt) of the days that have to be generated
+        to_generate = []
+        context_budget = context_token_budget // max(1, len(snapshot.days))
+        previous_day = {}
+        for day, day_messages in snapshot.days.items():
+            content_hash = day_summary_cache.hash_messages(day_messages)
+            cached_summary = day_summary_cache.get(channel_set, day, content_hash)
+            if cached_summary is None:
+                messages_to_summarize_str = await self.build_messages_str(day_messages, metrics, snapshot.formatted)
+                # the context messages are all older than the previous day, the order of each channel is kept
+                day_context = {channel_name: snapshot.context_by_channel.get(channel_name, [])
+                               + previous_day.get(channel_name, [])
+                               for channel_name in {**snapshot.context_by_channel, **previous_day}}
+                prompt = await self.build_packed_prompt(build_summary_prompt, day_context, day_messages,
+                                                        messages_to_summarize_str, metrics, snapshot.formatted,
+                                                        context_budget)
+                to_generate.append((len(day_summaries), day, content_hash, prompt))
+            day_summaries.append(cached_summary)
+            previous_day = day_messages
+
+        with metrics.stage('generation'):
+            # the generation executor bounds how many of these run at once
+            generated = await asyncio.gather(*(
+                generate_response_async(user_input, system_instruction, usage=metrics.usage)
+                for _, _, _, (system_instruction, user_input) in to_generate), return_exceptions=True)
+        errors = []
+        for (index, day, content_hash, _), summary in zip(to_generate, generated):
+            if isinstance(summary, Exception):
+                errors.append(summary)
+                continue
+            day_summaries[index] = summary.strip()
+            # cached even if other days failed, so running the command again only generates the failed days
+            day_summary_cache.put(channel_set, day, content_hash, day_summaries[index])
+        if errors:
+            raise RuntimeError(f"{len(errors)}/{len(to_generate)} days could not be summarized ({errors[0]!r}), "
+                               f"the summarized ones are kept for the next run")
+
+        day_summary_cache.evict()
+        metrics.counters['day_cache_hits'] += day_summary_cache.hits
+        metrics.counters['day_cache_misses'] += day_summary_cache.misses
+        print(day_summary_cache.report())
+        return day_summaries
+
+
+# version of the prompt templates of the templates folder to use
+prompt_template_version = os.getenv('PROMPT_TEMPLATE_VERSION', 'v1')
+
+templates_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+    """Return the content of a prompt template, in the configured version."""
+    with open(os.path.join(templates_path, f"{name}.{prompt_template_version}.txt"), encoding='utf-8') as file:
+        return file.read()
+
+
+def build_messages_prompt(context_messages_str, messages_to_summarize_str):
+    """Return the user input giving the context messages and the messages to summarize, shared by every command."""
+    return load_template('messages').format(context_messages_str=context_messages_str,
+                                            messages_to_summarize_str=messages_to_summarize_str)
+
+
+def build_summary_prompt(context_messages_str, messages_to_summarize_str):
+    """Return the (system instruction, user input) asking for the fandom formatted list of events.
+
+    The system instruction is static so it can be cached, only the user input changes from one call to another.
+    """
+    return (load_template('summary').format(hours_to_summarize=hours_to_summarize,
+                                            transcript_format=load_template(f'transcript_{transcript_format}')),
+            build_messages_prompt(context_messages_str, messages_to_summarize_str))
+
+
+def build_journal_prompt(context_messages_str, messages_to_summarize_str):
+    """Return the (system instruction, user input) asking for the summary as a TV news journal.
+
+    The journal template only holds what changes from the summary instructions, it's added after them.
+    """
+    return ((load_template('summary') + load_template('journal')).format(
+                hours_to_summarize=hours_to_summarize,
+                transcript_format=load_template(f'transcript_{transcript_format}')),
+            build_messages_prompt(context_messages_str, messages_to_summarize_str))
+
+
+if __name__ == "__main__":
+    client = MyClient()
+
+    # Run the client using the token
+    client.run(TOKEN)  # bot=False means it runs as a user account
+
+    print("hello")
@@ -0,0 +1,554 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import types
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# main reads its settings when it's imported
+os.environ.setdefault('HOURS_TO_SUMMARIZE', '720')
+os.environ.setdefault('HOURS_OF_CONTEXT', '1440')
+os.environ['ARCHIVE_PATH'] = os.path.join(tempfile.mkdtemp(), 'archive.db')
+
+import discord
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import main
+import benchmark
+
+
+@pytest.fixture
+def archive(monkeypatch, tmp_path):
+    archive = main.MessageArchive(str(tmp_path / 'archive.db'))
+    monkeypatch.setattr(main, 'message_archive', archive)
+    return archive
+
+
+def post(channel, moment, content="message"):
+    """Add a message to the history of a fake channel."""
+    message_id = discord.utils.time_snowflake(moment)
+    channel.messages.append(benchmark.FakeMessage(message_id, channel, moment, benchmark.FakeUser(1, "Valgard"),
+                                                  content, [], []))
+    channel.ids.append(message_id)
+
+
+def fetch(client, hours, now):
+    return asyncio.run(client.get_messages_since_last_x_hours(1, hours, now=now))
+
+
+def test_incremental_fetch(archive):
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    channel = benchmark.FakeChannel(1, 'rp', 0)
+    for minutes in range(0, 48 * 60, 10):
+        post(channel, now - timedelta(hours=48) + timedelta(minutes=minutes))
+    client = benchmark.BenchmarkClient([channel], [])
+    assert len(fetch(client, 48, now)) == 288
+    pages = channel.pages
+
+    # only the new messages are fetched, the others come from the archive
+    post(channel, now + timedelta(minutes=5), "nouveau")
+    messages = fetch(client, 48, now + timedelta(minutes=10))
+    assert channel.pages == pages + 1
+    assert len(messages) == 288
+    assert messages[-1].content == "nouveau"
+    assert archive.get_coverage(1)[1] == channel.ids[-1]
+
+
+def test_fetch_after_an_empty_window(archive):
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    channel = benchmark.FakeChannel(1, 'rp', 0)
+    client = benchmark.BenchmarkClient([channel], [])
+    assert fetch(client, 48, now) == []
+
+    post(channel, now + timedelta(minutes=5))
+    assert len(fetch(client, 48, now + timedelta(minutes=10))) == 1
+
+
+def test_fetch_skips_the_messages_older_than_the_window(archive):
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    channel = benchmark.FakeChannel(1, 'rp', 0)
+    for hours in range(150 * 24, -1, -2):
+        post(channel, now - timedelta(hours=hours))
+    client = benchmark.BenchmarkClient([channel], [])
+    first_run = now - timedelta(days=150)
+    assert len(fetch(client, 48, first_run)) == 1
+
+    # 150 days later, only the last 48 hours are fetched
+    pages = channel.pages
+    messages = fetch(client, 48, now)
+    assert len(messages) == 25
+    assert channel.pages - pages == 1
+    assert archive.get_coverage(1)[0] == now - timedelta(hours=48)
+    assert [m.id for m in fetch(client, 48, now)] == [m.id for m in messages]
+
+
+class RateLimitedChannel(benchmark.FakeChannel):
+    """Fake channel answering 429 after some messages of a history walk, once for each number in fail_after."""
+
+    def __init__(self, fail_after):
+        super().__init__(1, 'rp', 0)
+        self.fail_after = list(fail_after)
+        self.served = 0
+
+    async def history(self, **kwargs):
+        served = 0
+        async for message in super().history(**kwargs):
+            if self.fail_after and served == self.fail_after[0]:
+                self.fail_after.pop(0)
+                response = types.SimpleNamespace(status=429, reason="Too Many Requests", headers={'Retry-After': '0'})
+                raise discord.HTTPException(response, "rate limited")
+            served += 1
+            self.served += 1
+            yield message
+
+
+def rate_limited_history(fail_after, now):
+    channel = RateLimitedChannel(fail_after)
+    for minutes in range(0, 48 * 60, 5):
+        post(channel, now - timedelta(hours=48) + timedelta(minutes=minutes))
+    return channel
+
+
+def test_history_walk_resumes_after_a_rate_limit(archive, monkeypatch):
+    monkeypatch.setattr(main, 'history_fetch_max_backoff', 0)
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    channel = rate_limited_history([250, 120], now)
+    client = benchmark.BenchmarkClient([channel], [])
+    assert [m.id for m in fetch(client, 48, now)] == channel.ids
+    # the walk went on from the last stored message each time, nothing was fetched twice
+    assert channel.served == len(channel.ids)
+    assert archive.get_checkpoint(1) is None
+
+
+def test_history_walk_resumes_from_its_checkpoint(archive, monkeypatch):
+    monkeypatch.setattr(main, 'history_fetch_retries', 0)
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    channel = rate_limited_history([250], now)
+    client = benchmark.BenchmarkClient([channel], [])
+    with pytest.raises(discord.HTTPException):
+        fetch(client, 48, now)
+    # the pages fetched before the error are kept, the next run starts from the oldest one
+    assert archive.get_checkpoint(1) == channel.ids[-250]
+    assert archive.get_coverage(1) == (None, channel.ids[-1])
+
+    assert [m.id for m in fetch(client, 48, now)] == channel.ids
+    assert channel.served == len(channel.ids)
+    assert archive.get_checkpoint(1) is None
+
+
+class FailingBackend(main.FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    def create_cache(self, model_name, system_instruction, ttl):
+        self.attempts += 1
+        raise RuntimeError("quota exceeded")
+
+
+@pytest.fixture
+def min_tokens(monkeypatch):
+    monkeypatch.setattr(main, 'context_cache_min_tokens', 100)
+    return 100
+
+
+def expire_in(backend, delta):
+    """Move the expiration of the only cache of a backend to delta from now."""
+    (key, (cache, _)), = backend.caches.items()
+    backend.caches[key] = (cache, datetime.now(timezone.utc) + delta)
+
+
+def test_cache_threshold(min_tokens):
+    backend = main.FakeBackend()
+    assert backend.get_cache('model', 'x' * (min_tokens * 3 - 3)) is None
+    assert backend.get_cache('model', '') is None
+    assert backend.created_caches == []
+
+    cache = backend.get_cache('model', 'x' * (min_tokens * 3))
+    assert cache is not None
+    assert backend.get_cache('model', 'x' * (min_tokens * 3)) == cache
+    assert len(backend.created_caches) == 1
+
+
+def test_cache_per_model_and_instruction(min_tokens):
+    backend = main.FakeBackend()
+    backend.get_cache('model', 'x' * 1000)
+    backend.get_cache('other model', 'x' * 1000)
+    backend.get_cache('model', 'y' * 1000)
+    assert len(backend.created_caches) == 3
+
+
+def test_cache_renewed_before_expiry(min_tokens):
+    backend = main.FakeBackend()
+    first = backend.get_cache('model', 'x' * 1000)
+
+    expire_in(backend, timedelta(minutes=10))
+    assert backend.get_cache('model', 'x' * 1000) == first
+
+    # less than a minute left, a call could reference an expired cache
+    expire_in(backend, timedelta(seconds=30))
+    second = backend.get_cache('model', 'x' * 1000)
+    assert second != first
+    assert len(backend.created_caches) == 2
+
+
+def test_cache_failure_backoff(min_tokens):
+    backend = FailingBackend()
+    assert backend.get_cache('model', 'x' * 1000) is None
+    assert backend.get_cache('model', 'x' * 1000) is None
+    assert backend.attempts == 1
+
+    # tried again once the TTL is over
+    expire_in(backend, timedelta(seconds=-1))
+    assert backend.get_cache('model', 'x' * 1000) is None
+    assert backend.attempts == 2
+
+
+def test_generate_counts_cached_tokens(min_tokens):
+    backend = main.FakeBackend(response="* 3 tempopidum, NONE")
+    usage = main.TokenUsage()
+    text = backend.generate("messages", 'x' * 1000, 'model', main.freeze_settings(main.default_generation_config),
+                            main.freeze_settings(main.default_safety_settings), usage=usage)
+    assert text == "* 3 tempopidum, NONE"
+    assert usage.cached_tokens == main.estimate_tokens('x' * 1000)
+    assert usage.prompt_tokens == usage.cached_tokens + main.estimate_tokens("messages")
+
+
+@pytest.mark.parametrize('moment', [
+    datetime(2022, 9, 1), datetime(2022, 12, 31, 23, 59), datetime(2024, 2, 29, 12), datetime(2026, 10, 18, 5),
+    datetime(2022, 8, 31), datetime(2021, 1, 15),
+])
+def test_gaiartian_day_round_trip(moment):
+    year, day, month = main.calculate_gaiartian_date(moment)
+    start, end = main.gaiartian_day_to_utc_range(year, month, day)
+    assert start <= moment.replace(tzinfo=timezone.utc) < end
+    assert main.calculate_gaiartian_date(start) == (year, day, month)
+    assert main.calculate_gaiartian_date(end - timedelta(microseconds=1)) == (year, day, month)
+    assert main.calculate_gaiartian_date(end) != (year, day, month)
+
+
+def test_gaiartian_day_to_utc_range_invalid():
+    with pytest.raises(ValueError):
+        main.gaiartian_day_to_utc_range(0, 'Gaiarkhè', 1)
+    with pytest.raises(ValueError):
+        main.gaiartian_day_to_utc_range(1, 'Quinésil', 31)
+    with pytest.raises(ValueError):
+        main.gaiartian_day_to_utc_range(1, 'Juillet', 1)
+
+
+def test_events_replaced_only_for_days_inside_the_window(tmp_path):
+    store = main.EventStore(str(tmp_path / 'events.db'))
+    # the 17th and 18th of October 2026 are the 17 and 18 Tempopidum of the year 13
+    store.add_events([(13, 1, 17, "Matin du 17"), (13, 1, 18, "[[Paix]] signée")],
+                     datetime(2026, 10, 16, 12, tzinfo=timezone.utc))
+    # the next window starts in the middle of the 17, only its evening was summarized again
+    store.add_events([(13, 1, 17, "Soir du 17"), (13, 1, 18, "Signature de la [[Paix]]"),
+                      (13, 1, 32, "Hors calendrier")], datetime(2026, 10, 17, 12, tzinfo=timezone.utc))
+    assert store.get_year(13) == [(1, 17, "Matin du 17"), (1, 17, "Soir du 17"), (1, 18, "Signature de la [[Paix]]"),
+                                  (1, 32, "Hors calendrier")]
+    assert store.get_entity_events('Paix') == [(13, 1, 18, "Signature de la [[Paix]]")]
+
+    # digests add their events without replacing anything
+    store.add_events([(13, 1, 18, "[[Kaetern]] arrive")])
+    assert len(store.get_year(13)) == 5
+
+
+def archived(message_id, content, channel_id=1, author='Valgard', bot=False):
+    return main.ArchivedMessage(message_id, channel_id, datetime(2026, 10, 18, tzinfo=timezone.utc), author,
+                                content, bot)
+
+
+def test_split_messages_by_hours():
+    now = datetime(2026, 10, 18, 12, tzinfo=timezone.utc)
+    messages = [archived(discord.utils.time_snowflake(now - timedelta(hours=hours)), str(hours))
+                for hours in (50, 49, 48.01, 48, 47.99, 10, 0)]
+    recent, older = asyncio.run(main.split_messages_by_hours(messages, 48, now))
+    assert [m.content for m in older] == ['50', '49', '48.01']
+    assert [m.content for m in recent] == ['48', '47.99', '10', '0']
+
+    recent, older = asyncio.run(main.split_messages_by_hours([], 48, now))
+    assert recent == older == []
+
+
+def test_split_for_discord_packs_lines():
+    lines = [f"ligne {i}\n" for i in range(500)]
+    pieces = main.split_for_discord(''.join(lines), limit=100)
+    assert ''.join(pieces) == ''.join(lines)
+    assert all(len(piece) <= 100 for piece in pieces)
+    # lines are never cut when they fit
+    assert all(piece.endswith('\n') for piece in pieces)
+
+
+def test_split_for_discord_cuts_long_lines_between_words():
+    text = "court\n" + ' '.join(["mot"] * 100) + "\nfin"
+    pieces = main.split_for_discord(text, limit=50)
+    assert ''.join(pieces) == text
+    assert all(len(piece) <= 50 for piece in pieces)
+    assert all(piece.endswith((' ', '\n')) for piece in pieces[:-1])
+    assert main.split_for_discord("x" * 120, limit=50) == ["x" * 50, "x" * 50, "x" * 20]
+    assert main.split_for_discord("") == []
+
+
+def test_parse_fandom_events():
+    # the 18th of October 2026 is in Tempopidum of the year 13
+    reference = datetime(2026, 10, 18, tzinfo=timezone.utc)
+    text = "\n".join([
+        "* 1 gaiarkhè, [[Valgard]] fonde [[Port-Sel]]",
+        "* 3 tempopidum",
+        "** Traité de [[Paix]] signé",
+        "** [[Kaetern]] part en exil",
+        "* 4 tempopidum, NONE",
+        "Pas au format",
+        "** ignoré, pas de jour",
+        "* 20 éposendre, Tempête sur [[Port-Sel]]",
+    ])
+    assert main.parse_fandom_events(text, reference) == [
+        (13, 0, 1, "[[Valgard]] fonde [[Port-Sel]]"),
+        (13, 1, 3, "Traité de [[Paix]] signé"),
+        (13, 1, 3, "[[Kaetern]] part en exil"),
+        (12, 3, 20, "Tempête sur [[Port-Sel]]"),
+    ]
+
+
+def test_filter_noise(monkeypatch):
+    monkeypatch.setattr(main, 'noise_filters', ['bot', 'empty', 'ooc', 'short', 'crosspost'])
+    monkeypatch.setattr(main, 'noise_min_words', 2)
+    rp = archived(1, "Valgard entre dans la taverne")
+    messages_by_channel = {
+        'rp': [rp, archived(2, "Annonce du serveur", bot=True), archived(3, "<:epee:123> !!"),
+               archived(4, "(je reviens dans 5 min)"), archived(5, "ok"), archived(7, "Le soleil se lève.")],
+        'annonces': [archived(6, "valgard ENTRE dans la taverne !", channel_id=2),
+                     archived(8, "Le soleil se lève", channel_id=2)],
+    }
+    removed = defaultdict(Counter)
+    filtered = main.filter_noise(messages_by_channel, removed)
+    # the first copy of a cross-post is kept
+    assert filtered == {'rp': [rp, messages_by_channel['rp'][5]], 'annonces': []}
+    assert {rule: counts['messages'] for rule, counts in removed.items()} == {
+        'bot': 1, 'empty': 1, 'ooc': 1, 'short': 1, 'crosspost': 2}
+    assert all(counts['tokens'] > 0 for counts in removed.values())
+
+
+def test_filter_noise_disabled(monkeypatch):
+    monkeypatch.setattr(main, 'noise_filters', [])
+    messages_by_channel = {'rp': [archived(1, "ok", bot=True)], 'autre': [archived(2, "ok", channel_id=2)]}
+    removed = defaultdict(Counter)
+    assert main.filter_noise(messages_by_channel, removed) == messages_by_channel
+    assert not removed
+
+
+@pytest.mark.parametrize('response, score', [
+    ("7", 7), ("10\n", 10), ("0", 0), ("Note : 8/10", 8), ("17 Tempopidum : 3", 3), ("3 Tempopidum : 9.", 9),
+    ("7 sur 10", 7), ("Note : 3 sur 10.", 3), ("Importance : 2/10 — rien de notable", 2), ("10/10", 10),
+    ("17 Tempopidum : 4 sur 10", 4), ("17", None), ("Aucune note", None), (ValueError("boom"), None),
+])
+def test_triage_score(response, score):
+    assert main.triage_score(response) == score
+
+
+@pytest.fixture
+def day_cache(monkeypatch, tmp_path):
+    cache = main.DaySummaryCache(str(tmp_path / 'days.db'))
+    monkeypatch.setattr(main, 'day_summary_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    """Replace Gemini with a canned answer, recording the user inputs."""
+    user_inputs = []
+
+    async def generate(user_input, system_instruction, **kwargs):
+        user_inputs.append(user_input)
+        return "* 1 gaiarkhè, NONE"
+
+    monkeypatch.setattr(main, 'generate_response_async', generate)
+    return user_inputs
+
+
+def history_of_days(first_day, n_days):
+    """Messages of a few authors every 4 hours, a different author opening each day."""
+    authors = ['PainOraisins', 'Kaetern', 'Valgard']
+    messages = []
+    for hour in range(0, n_days * 24, 4):
+        moment = first_day + timedelta(hours=hour)
+        messages.append(main.ArchivedMessage(discord.utils.time_snowflake(moment), 1, moment,
+                                             authors[(hour // 4 + hour // 24) % 3], f"message {hour}"))
+    return messages
+
+
+def test_day_cache_hits_until_a_day_changes(day_cache, generated):
+    client = main.MyClient()
+    history = history_of_days(datetime(2026, 10, 10, tzinfo=timezone.utc), 3)
+    asyncio.run(client.summarize_by_day(main.Snapshot({'rp': history}, {}), main.RunMetrics('summarize')))
+    assert len(generated) == 3
+
+    metrics = main.RunMetrics('summarize')
+    summaries = asyncio.run(client.summarize_by_day(main.Snapshot({'rp': history}, {}), metrics))
+    assert summaries == ["* 1 gaiarkhè, NONE"] * 3
+    assert (metrics.counters['day_cache_hits'], metrics.counters['day_cache_misses']) == (3, 0)
+
+    # an edited message only invalidates its own day
+    history[-1].content = "message modifié"
+    metrics = main.RunMetrics('summarize')
+    asyncio.run(client.summarize_by_day(main.Snapshot({'rp': history}, {}), metrics))
+    assert len(generated) == 4
+    assert "message modifié" in generated[-1]
+    assert (metrics.counters['day_cache_hits'], metrics.counters['day_cache_misses']) == (2, 1)
+
+
+def test_day_cache_hit_when_the_window_slides(day_cache, generated):
+    client = main.MyClient()
+    history = history_of_days(datetime(2026, 10, 10, tzinfo=timezone.utc), 5)
+    window = [m for m in history if m.created_at < datetime(2026, 10, 14, tzinfo=timezone.utc)]
+    metrics = main.RunMetrics('summarize')
+    asyncio.run(client.summarize_by_day(main.Snapshot({'rp': window}, {}), metrics))
+    assert len(generated) == 4
+    assert (metrics.counters['day_cache_hits'], metrics.counters['day_cache_misses']) == (0, 4)
+
+    # a day later, the first day left the window and the aliases are numbered from another author
+    window = [m for m in history if m.created_at >= datetime(2026, 10, 11, tzinfo=timezone.utc)]
+    metrics = main.RunMetrics('summarize')
+    asyncio.run(client.summarize_by_day(main.Snapshot({'rp': window}, {}), metrics))
+    assert len(generated) == 5
+    assert (metrics.counters['day_cache_hits'], metrics.counters['day_cache_misses']) == (3, 1)
+
+
+class RecordingChannel(benchmark.FakeOutputChannel):
+    """Controller channel keeping what the commands send."""
+
+    def __init__(self):
+        super().__init__()
+        self.contents = []
+
+    async def send(self, content=None, **kwargs):
+        self.contents.append(content)
+        return await super().send(content, **kwargs)
+
+
+def test_jobs_deduplicated_and_cancelled():
+    async def run():
+        client = benchmark.BenchmarkClient([], [])
+        output = RecordingChannel()
+        started = asyncio.Event()
+        finished = []
+
+        async def command(message, metrics):
+            started.set()
+            await asyncio.sleep(60)
+            finished.append(message.content)
+
+        worker = asyncio.create_task(client.process_jobs())
+        await client.queue_job('$summarize', command, benchmark.FakeCommand(output, '$summarize'))
+        await started.wait()
+        await client.queue_job('$summarize', command, benchmark.FakeCommand(output, '$summarize'))
+        await client.queue_job('$journal', command, benchmark.FakeCommand(output, '$journal'))
+        summarize, journal = client.jobs.values()
+        assert output.contents == [f"$summarize is already running (job #{summarize.id}), "
+                                   f"its result will be posted here."]
+        assert (summarize.state(), journal.state()) == ('running', 'queued')
+
+        # a queued job is dropped at once, a running one once its task has stopped
+        await client.cancel_job(benchmark.FakeCommand(output, f'$cancel {journal.id}'))
+        await client.cancel_job(benchmark.FakeCommand(output, f'$cancel {summarize.id}'))
+        await client.job_queue.join()
+        worker.cancel()
+        assert output.contents[1:] == [f"Job #{journal.id} ($journal) cancelled.",
+                                       f"Job #{summarize.id} ($summarize) cancelled."]
+        assert client.jobs == {}
+        assert finished == []
+        assert client.status() == "No command queued or running."
+
+    asyncio.run(run())
+
+
+class ScriptedBackend(main.FakeBackend):
+    """Fake backend whose calls take the latencies, or raise the errors, of a script, in order."""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.calls = 0
+        self.script_lock = threading.Lock()
+
+    def generate_content(self, *args):
+        with self.script_lock:
+            step = self.script[min(self.calls, len(self.script) - 1)]
+            self.calls += 1
+        if isinstance(step, Exception):
+            raise step
+        self.latency = step
+        return super().generate_content(*args)
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    """Run the Gemini calls on a fresh backend, executor and latency history."""
+    def configure(script, workers=4, timeout=5, retries=0, recent_latencies=()):
+        backend = ScriptedBackend(script)
+        monkeypatch.setattr(main, 'llm_backend', backend)
+        monkeypatch.setattr(main, 'generation_executor', ThreadPoolExecutor(max_workers=workers))
+        monkeypatch.setattr(main, 'generation_timeout', timeout)
+        monkeypatch.setattr(main, 'generation_retries', retries)
+        monkeypatch.setattr(main, 'generation_max_backoff', 0)
+        monkeypatch.setattr(main, 'generation_latencies', defaultdict(lambda: deque(maxlen=200)))
+        main.generation_latencies['model'].extend(recent_latencies)
+        return backend
+    return configure
+
+
+def generate(n=1):
+    async def run():
+        return await asyncio.gather(*(main.generate_response_async(f"messages {i}", None, model='model')
+                                      for i in range(n)), return_exceptions=True)
+    return asyncio.run(run())
+
+
+def test_generation_deadline(generation):
+    backend = generation([0.5], timeout=0.1)
+    assert [type(result) for result in generate()] == [TimeoutError]
+    assert backend.calls == 1
+
+
+def test_generation_deadline_ignores_the_wait_for_a_worker(generation):
+    backend = generation([0.3], workers=1, timeout=0.5)
+    assert generate(3) == ["* 1 gaiarkhè, NONE"] * 3
+    assert backend.calls == 3
+
+
+def test_generation_retries(generation):
+    backend = generation([google_exceptions.TooManyRequests("quota"), google_exceptions.InternalServerError("oops"),
+                          0], retries=2)
+    assert generate() == ["* 1 gaiarkhè, NONE"]
+    assert backend.calls == 3
+
+    # invalid requests are not retried
+    backend = generation([google_exceptions.InvalidArgument("bad"), 0], retries=2)
+    assert [type(result) for result in generate()] == [google_exceptions.InvalidArgument]
+    assert backend.calls == 1
+
+
+def test_generation_hedged(generation):
+    # slower than all the recent calls, a duplicate is sent and answers first
+    backend = generation([2, 0], recent_latencies=[0.05] * 20)
+    start = time.monotonic()
+    assert generate() == ["* 1 gaiarkhè, NONE"]
+    assert time.monotonic() - start < 1
+    assert backend.calls == 2
+
+    # not before enough calls are known
+    backend = generation([0.2, 0], recent_latencies=[0.05] * 5)
+    assert generate() == ["* 1 gaiarkhè, NONE"]
+    assert backend.calls == 1
+
+
+def test_generation_duplicate_dropped_while_queued(generation):
+    # the duplicate waits for the only worker, the first call answers before it starts
+    backend = generation([0.3, 0], workers=1, recent_latencies=[0.05] * 20)
+    assert generate() == ["* 1 gaiarkhè, NONE"]
+    time.sleep(0.1)
+    assert backend.calls == 1